@@ -0,0 +1,57 @@
+# Copyright 2015-2023 D.G. MacCarthy <https://dmaccarthy.github.io/sc8pr>
+#
+# This file is part of "sc8pr".
+#
+# "sc8pr" is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# "sc8pr" is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with "sc8pr".  If not, see <http://www.gnu.org/licenses/>.
+
+"Measure memory per graphic instance: python benchmarks/memory.py [count]"
+
+import os, sys
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import tracemalloc
+from random import uniform
+from sc8pr import Sketch, Image, SharedImage, SharedSprite
+from sc8pr.sprite import Sprite
+
+
+def perInstance(make, n):
+    "Average bytes allocated per instance, including one frame of drawing"
+    sk = Sketch((640,480)).config(headless=True)
+    sk._start(None, None, 0)
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for i in range(n):
+        sk += make().config(pos=(uniform(0, 640), uniform(0, 480)), height=8)
+    sk._render()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(s.size_diff for s in after.compare_to(before, "filename"))
+    sk._stop()
+    return size / n
+
+
+def main(n=10000):
+    img = Image((16,16), "red")
+    tests = [("Image", lambda: Image(img.original)),
+        ("SharedImage", lambda: SharedImage(img)),
+        ("Sprite", lambda: Sprite(img)),
+        ("SharedSprite", lambda: SharedSprite(img))]
+    for name, make in tests:
+        print("{:<14}{:8.0f} bytes".format(name, perInstance(make, n)))
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,298 @@
+# Copyright 2015-2023 D.G. MacCarthy <https://dmaccarthy.github.io/sc8pr>
+#
+# This file is part of "sc8pr".
+#
+# "sc8pr" is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# "sc8pr" is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with "sc8pr".  If not, see <http://www.gnu.org/licenses/>.
+
+"""Headless benchmark suite:
+python benchmarks/run.py [-q] [-o results.json] [-c baseline.json] [name ...]"""
+
+import os, sys, json, platform, tempfile
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from time import perf_counter, strftime
+from random import seed, uniform, randint
+import pygame
+import sc8pr
+from sc8pr import Sketch, Canvas, Image, BOTH
+from sc8pr.sprite import Sprite, Collisions
+from sc8pr.shape import Circle, Line, Polygon, PolygonSprite, ArrowSprite
+from sc8pr.text import Text
+
+Sketch._banner = None   # Keep stdout clean for JSON output
+
+W, H = 640, 480
+_benchmarks = []
+
+
+def benchmark(unit, n):
+    "Decorator to register a benchmark function with its unit and default size"
+    def reg(f):
+        _benchmarks.append((f.__name__, f, unit, n))
+        return f
+    return reg
+
+
+def best(func, repeat=3):
+    "Return the shortest of several timings of a function call"
+    t = []
+    for i in range(repeat):
+        t0 = perf_counter()
+        func()
+        t.append(perf_counter() - t0)
+    return min(t)
+
+
+def scene(n, make):
+    "Create a started headless sketch populated with n graphics"
+    seed(n)
+    sk = Sketch((W, H)).config(headless=True, bg="white")
+    sk._start(None, None, 0)
+    for i in range(n): sk += make(i).config(pos=(uniform(0, W), uniform(0, H)))
+    return sk
+
+
+def drawRate(sk, frames=20):
+    "Frames per second for Canvas.draw of a sketch"
+    sk.draw()
+    t = best(lambda: [sk.draw() for i in range(frames)])
+    sk._stop()
+    return frames / t
+
+
+# Benchmarks...
+
+@benchmark("fps", 1000)
+def draw_images(n):
+    img = Image((16, 16), "red")
+    return drawRate(scene(n, lambda i: Image(img.original).config(angle=i % 360)))
+
+@benchmark("fps", 1000)
+def draw_shapes(n):
+    def make(i):
+        k = i % 3
+        if k == 0: return Circle(8).config(fill="blue", weight=1)
+        if k == 1: return Line((0, 0), (16, 12)).config(weight=2)
+        return Polygon([(0, 0), (16, 0), (8, 12)]).config(fill="green", angle=i)
+    return drawRate(scene(n, make))
+
+@benchmark("fps", 300)
+def move_polygons(n, frames=100):
+    "Frames per second (update and draw) for moving and spinning polygon sprites"
+    def make(i):
+        if i % 2: g = PolygonSprite([(0, 0), (20, 0), (24, 10), (10, 18), (0, 12)])
+        else: g = ArrowSprite(length=30, width=6)
+        return g.config(fill="green", vel=(uniform(-2, 2), uniform(-2, 2)),
+            spin=3 if i % 3 == 0 else 0, bounce=BOTH)
+    sk = scene(n, make)
+    t0 = perf_counter()
+    for i in range(frames): sk._frame()
+    t = perf_counter() - t0
+    sk._stop()
+    return frames / t
+
+@benchmark("fps", 250)
+def draw_text(n):
+    return drawRate(scene(n, lambda i: Text(i).config(fontSize=14, color="black")))
+
+@benchmark("fps", 500)
+def play_sprites(n, frames=120):
+    "Frames per second of Sketch.play with a display window"
+    seed(n)
+    img = Image((12, 12), "red")
+    sk = Sketch((W, H)).config(frameRate=10000)
+    def setup(sk):
+        for i in range(n):
+            sk += Sprite(img).config(pos=(uniform(0, W), uniform(0, H)),
+                vel=(uniform(-2, 2), uniform(-2, 2)), spin=1, bounce=BOTH)
+    def ondraw(sk, ev):
+        if sk.frameCount == 1: sk._t0 = perf_counter()
+        elif sk.frameCount > frames: sk.quit = True
+    sk.bind(setup, ondraw)
+    sk.play()
+    return frames / (perf_counter() - sk._t0)
+
+@benchmark("calls/s", 2000)
+def collisions_among(n, calls=20):
+    sk = scene(n, lambda i: Sprite(Image((10, 10), "red")))
+    sk._render()
+    c = Collisions(sk)
+    def run():
+        for i in range(calls):
+            sk.frameCount += 1
+            c.among()
+    t = best(run)
+    sk._stop()
+    return calls / t
+
+@benchmark("events/s", 32)
+def dispatch_nested(depth, count=2000):
+    "EventManager.dispatch with the mouse over a deeply nested canvas"
+    sk = Sketch((W, H)).config(headless=True)
+    sk._start(None, None, 0)
+    cv = sk
+    for i in range(depth):
+        w, h = cv.size
+        c = Canvas((w - 8, h - 8), "grey" if i % 2 else "white")
+        cv += c.config(anchor=0, pos=(4, 4))
+        cv = c
+    cv += Image((8, 8), "red").config(pos=cv.center)
+    sk.bind(onmousemotion=lambda sk, ev: None)
+    sk._render()
+    x, y = W // 2, H // 2
+    def run():
+        d = sk.evMgr.dispatch
+        for i in range(count):
+            d(pygame.event.Event(pygame.MOUSEMOTION, pos=(x + i % 3, y),
+                rel=(1, 0), buttons=(0, 0, 0)))
+    t = best(run)
+    sk._stop()
+    return count / t
+
+def _effects():
+    "Instances of every transition in sc8pr.effect"
+    from sc8pr import effect
+    from sc8pr.effect import math, stamp
+    fx = []
+    for mod in (effect, math, stamp):
+        for name, cls in sorted(vars(mod).items()):
+            if (type(cls) is type and issubclass(cls, effect.Effect) and
+                    cls.__module__ == mod.__name__ and hasattr(cls, "apply")
+                    and not name.endswith("Effect") and name != "Stamp"):
+                fx.append((name, cls))
+    return fx
+
+@benchmark("frames/s", 30)
+def effects(frames):
+    "Transition frames per second for each effect applied to a 320x240 image"
+    pygame.init()
+    pygame.display.set_mode((1, 1))
+    srf = Image((320, 240), "red").image
+    results = {}
+    for name, cls in _effects():
+        try:
+            e = cls().time(0, frames + 1)
+            results[name] = frames / best(lambda: [e.transition(srf, f)
+                for f in range(1, frames + 1)], 1)
+        except Exception as err: results[name] = repr(err)
+    pygame.quit()
+    return results
+
+@benchmark("frames/s", 100)
+def video(frames):
+    "Write and read throughput of a Video archive with 320x240 frames"
+    from sc8pr.misc.video import Video
+    pygame.init()
+    srf = [Image((320, 240), (randint(0, 255), 0, 0)).image for i in range(frames)]
+    with tempfile.TemporaryDirectory() as tmp:
+        fn = os.path.join(tmp, "bench.s8v")
+        t0 = perf_counter()
+        with Video(fn, mode="w") as v:
+            for s in srf: v.write(s)
+        tw = perf_counter() - t0
+        size = os.path.getsize(fn)
+        t0 = perf_counter()
+        with Video(fn) as v:
+            for i in range(len(v)): v[i].image
+        tr = perf_counter() - t0
+    pygame.quit()
+    return {"write": frames / tw, "read": frames / tr, "bytes": size}
+
+@benchmark("renders/s", 500)
+def text_render(n):
+    pygame.init()
+    t = Text().config(fontSize=24, color="black", bg="white", padding=4)
+    data = ["Line {}\nof sc8pr text".format(i) for i in range(n)]
+    def run():
+        for d in data:
+            t.data = d
+            t.render()
+    r = n / best(run)
+    pygame.quit()
+    return r
+
+@benchmark("ms", 7)
+def import_time(n, budget=10):
+    "Median time (in a new process, after importing pygame) to import sc8pr modules"
+    import subprocess, statistics
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    code = "import pygame, time\nt = time.perf_counter()\nimport {}\nprint(time.perf_counter() - t)"
+    r = {}
+    for m in ("sc8pr", "sc8pr.plot.json", "sc8pr.misc.video"):
+        t = [float(subprocess.run([sys.executable, "-c", code.format(m)], env=env, check=True,
+            capture_output=True, text=True).stdout.split()[-1]) for i in range(n)]
+        r[m] = 1000 * statistics.median(t)
+    if r["sc8pr"] > budget:
+        print("import_time: sc8pr import {:.1f} ms exceeds budget of {} ms".format(
+            r["sc8pr"], budget), file=sys.stderr)
+    return r
+
+
+# Running and reporting...
+
+def runAll(names=None, quiet=False):
+    results = {}
+    for name, f, unit, n in _benchmarks:
+        if names and name not in names: continue
+        t0 = perf_counter()
+        r = f(n)
+        results[name] = {"n": n, "unit": unit, "result": r,
+            "time": round(perf_counter() - t0, 3)}
+        if not quiet: report(name, results[name])
+    return {"sc8pr": "{}.{}.{}".format(*sc8pr.version), "pygame": pygame.version.ver,
+        "python": platform.python_version(), "platform": platform.platform(),
+        "date": strftime("%Y-%m-%d %H:%M:%S"), "results": results}
+
+def report(name, r, base=None):
+    "Print one result, with the ratio to a baseline result if provided"
+    val = r["result"]
+    if type(val) is dict:
+        print("{} (n={}, {})".format(name, r["n"], r["unit"]), file=sys.stderr)
+        for k, v in val.items():
+            b = base["result"].get(k) if base else None
+            report("  " + k, {"result": v}, {"result": b} if b is not None else None)
+        return
+    if type(val) is str: s = val
+    else:
+        s = "{:12.1f}".format(val)
+        if "unit" in r: s += " {} (n={})".format(r["unit"], r["n"])
+        b = base["result"] if base else None
+        if type(b) in (int, float) and b: s += "  x{:.2f}".format(val / b)
+    print("{:<20}{}".format(name, s), file=sys.stderr)
+
+def main(argv):
+    import argparse
+    p = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    p.add_argument("names", nargs="*", help="benchmarks to run (default: all)")
+    p.add_argument("-o", "--output", help="write JSON results to a file ('-' for stdout)")
+    p.add_argument("-c", "--compare", help="JSON results of a previous run to compare")
+    p.add_argument("-q", "--quiet", action="store_true")
+    a = p.parse_args(argv)
+    base = None
+    if a.compare:
+        with open(a.compare) as f: base = json.load(f)["results"]
+    data = runAll(a.names, a.quiet or base is not None)
+    if base is not None:
+        print("Compared to {}:".format(a.compare), file=sys.stderr)
+        for name, r in data["results"].items(): report(name, r, base.get(name))
+    if a.output == "-": print(json.dumps(data, indent=1))
+    elif a.output:
+        with open(a.output, "w") as f: json.dump(data, f, indent=1)
+    return data
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -17,17 +17,17 @@
 
 
 version = 3, 0, 4
-print("sc8pr {}.{}.{}: https://dmaccarthy.github.io/sc8pr".format(*version))
 
 import sys, struct
 from math import hypot, sqrt
 import pygame
 import pygame.display as _pd
 from pygame.transform import flip as _pyflip
-from sc8pr._event import EventManager
+from sc8pr._event import EventManager, HandlerMeta, coalesce
 from sc8pr._cs import CoordSys
+from sc8pr._grid import RectGrid
 from sc8pr.geom import transform2d, delta, sigma, vmult, neg
-from sc8pr.util import CachedSurface, style, logError, sc8prData, resolvePath, tile, rgba, hasAlpha, surface, drawBorder, crop, export, customEv
+from sc8pr.util import CachedSurface, style, logError, sc8prData, resolvePath, tile, rgba, hasAlpha, surface, drawBorder, crop, export, customEv, mergeRects, AssetCache, iscoroutinefunction, asyncHandler
 
 # Anchor point constants
 TOPLEFT = 0
@@ -55,17 +55,30 @@ SIZECHANGED = getattr(pygame, "WINDOWSIZECHANGED", None)
 WINEXPOSED = getattr(pygame, "WINDOWEXPOSED", None)
 EVENT_TYPE = pygame.event.EventType  # Could become deprecated?
 
-pygame.init()
-pygame.key.set_repeat(400, 80)
+# Submodules loaded on first attribute access (PEP 562)
+_submodules = {"effect", "geom", "gui", "misc", "plot", "robot", "shape", "sprite", "text", "util"}
 
+def __getattr__(name):
+    if name in _submodules:
+        from importlib import import_module
+        return import_module("sc8pr." + name)
+    raise AttributeError("module 'sc8pr' has no attribute '{}'".format(name))
 
-class Graphic:
+def __dir__(): return sorted(set(globals()) | _submodules)
+
+
+class Graphic(metaclass=HandlerMeta):
     """Base class for graphics objects. Subclasses may provide a 'draw' method
     that draws the graphic onto the canvas as described by the clipping region
     of the surface passed as an argument. Alternatively, the subclass may
     provide a 'image' property which gives a surface that Graphic.draw can use."""
+    __slots__ = ()
     autoPositionOnResize = True
-    removeFrame = None
+    _removeFrame = None
+    _version = 0
+    _painted = 0
+    _mask = _maskCache = None
+    _pathCache = None
     _avgColor = None
     _preserve = "xy", "size"
     scrollable = True
@@ -81,6 +94,20 @@ class Graphic:
     def update(self, ev):
         if hasattr(self, "ondraw"): self.ondraw(ev)
 
+    @property
+    def _active(self):
+        "Check whether the graphic needs to be updated each frame"
+        return (type(self).update is not Graphic.update or hasattr(self, "ondraw")
+            or hasattr(self, "_animScript") or self._removeFrame is not None)
+
+    @property
+    def removeFrame(self): return self._removeFrame
+
+    @removeFrame.setter
+    def removeFrame(self, n):
+        self._removeFrame = n
+        Graphic._version += 1
+
     @property
     def name(self):
         "The key used when adding the instance to a canvas"
@@ -94,7 +121,10 @@ class Graphic:
 
     def anon(self):
         "Remove the instance's key (_name)"
-        if hasattr(self, "_name"): del self._name
+        if hasattr(self, "_name"):
+            keys = getattr(self.canvas, "_keys", None)
+            if keys and keys.get(self._name) is self: del keys[self._name]
+            del self._name
         return self
 
     def __str__(self):
@@ -112,17 +142,19 @@ class Graphic:
 
     def config(self, **kwargs):
         "Set multiple instance properties"
-        for i in kwargs.items(): setattr(self, *i)
+        for k, v in kwargs.items():
+            setattr(self, k, v)
+            if k[:2] == "on": Graphic._version += 1
         return self
 
     def bind(self, *args, **kwargs):
         "Bind functions to an instance as methods"
-        for f in args:
-            setattr(self, f.__name__, f.__get__(self, self.__class__))
-        for n, f in kwargs.items():
+        for n, f in [(f.__name__, f) for f in args] + list(kwargs.items()):
             if f is None: delattr(self, n)
             else:
+                if n[:2] == "on" and iscoroutinefunction(f): f = asyncHandler(f)
                 setattr(self, n, f.__get__(self, self.__class__))
+        Graphic._version += 1
         return self
 
     @property
@@ -240,7 +272,7 @@ class Graphic:
     def _setCanvas(self, cv, key):
         self.remove()
         if key:
-            if key in cv and cv[key] is not self:
+            if cv._keys.get(key, self) is not self:
                 raise KeyError("Key '{}' is already in use".format(key))
             self._name = key
         if cv.sketch is not None:
@@ -249,6 +281,11 @@ class Graphic:
                 raise ValueError("Can't add graphic with expired removeFrame value")
         self.canvas = cv
         cv._items.append(self)
+        cv._members.add(self)
+        key = self.name
+        if key is not None: cv._keys.setdefault(key, self)
+        Graphic._version += 1
+        if cv._hitGrid is not None: cv._hitGrid.add(self, getattr(self, "rect", None))
 
     def setCanvas(self, cv, key=None):
         "Add the object to a canvas"
@@ -264,9 +301,14 @@ class Graphic:
         try:
             if deleteRect and hasattr(self, "rect"):
                 del self.rect
-            if cv:
+            if cv and self in cv._members:
                 self.anon()
-                cv._items.remove(self)
+                items = cv._items
+                if items[-1] is self: items.pop()
+                else: items.remove(self)
+                cv._members.discard(self)
+                Graphic._version += 1
+                if cv._hitGrid is not None: cv._hitGrid.discard(self)
                 if self.focussed: self.blur()
         except: pass
         return self
@@ -280,17 +322,18 @@ class Graphic:
 
     @property
     def layer(self):
-        try: return self.canvas._items.index(self)
-        except: pass
+        cv = self.canvas
+        if cv and self in cv._members: return cv._items.index(self)
 
     @layer.setter
     def layer(self, n):
         "Arrange graphic within canvas"
-        g = self.canvas._items
+        cv = self.canvas
+        g = cv._items
         if n < 0: n += len(g)
-        i = g.index(self)
-        g = g[:i] + g[i+1:]
-        self.canvas._items = g[:n] + [self] + g[n:]
+        del g[g.index(self)]
+        g.insert(n, self)
+        cv._hitGrid = None
 
     @property
     def sketch(self):
@@ -326,7 +369,14 @@ class Graphic:
         return self
 
     @property
-    def path(self): return self.pathTo(None)
+    def path(self):
+        "List of parent canvases, beginning with the instance itself"
+        cv = self.canvas
+        p = None if cv is None else cv.path
+        c = self._pathCache
+        if c is None or c[0] is not p:   # Canvas or one of its ancestors changed
+            c = self._pathCache = p, [self] if p is None else [self] + p
+        return c[1]
 
     def pathTo(self, cv):
         "List of parent canvases, beginning with the instance itself"
@@ -361,22 +411,52 @@ class Graphic:
         srf.blit(img, r.topleft)
         return r
 
+    def _drawKey(self):
+        "Return a key that changes whenever the graphic would draw differently, or None if unknown"
+        if type(self).draw is Graphic.draw: return self._imageKey()
+
+    def _imageKey(self):
+        "Key for graphics that are drawn by blitting their image"
+        if not self.effects:
+            img = self.image
+            return tuple(self.calcBlitRect(img.get_size())), img, self._painted
+
     @property
     def surfaceEffect(self):
         "Apply effects to the surface"
         srf = self.image
         if self.effects:
             srf = srf.copy()
-            f = self.sketch.frameCount
+            sk = self.sketch
+            f = sk.frameCount
+            prof = sk.profiler
             rmv = []
             for e in self.effects:
                 if f > e._t_max and e.remove: rmv.append(e)
 #                 if f <= e._t_max and f >= e._t_min:
-                else: srf = e.transition(srf, f)
+                else:
+                    if prof: t = prof.time()
+                    srf = e.transition(srf, f)
+                    if prof: prof.add("effect:" + type(e).__name__, t)
             if rmv:
                 for e in rmv: self.effects.remove(e)
         return srf
 
+    @property
+    def mask(self):
+        "Collision mask for the current image, cached until the image changes"
+        return self._autoMask() if self._mask is None else self._mask
+
+    @mask.setter
+    def mask(self, m): self._mask = m
+
+    def _autoMask(self):
+        img = self.image
+        c = self._maskCache
+        if c is None or c[0] is not img:
+            c = self._maskCache = img, pygame.mask.from_surface(img)
+        return c[1]
+
     def snapshot(self, **kwargs):
         "Take a snapshot of the graphic and return it as a new Image instance"
         srf = self.surfaceEffect
@@ -412,7 +492,9 @@ class Graphic:
             for i in range(n):
                 if type(script[i]) is int: script[i] = [script[i]]
                 if adjust: script[i][0] += adjust
-            if not hasattr(self, "_animScript"): self._animScript = {}
+            if not hasattr(self, "_animScript"):
+                self._animScript = {}
+                Graphic._version += 1
             self._animScript[key] = script
         return self
 
@@ -518,6 +600,7 @@ class Renderable(Graphic):
 
 class BaseSprite(Graphic):
     "Base class for sprite animations"
+    __slots__ = ()
     # Edge behaviours
     wrap = REMOVE
     bounce = bounceType = 0
@@ -707,8 +790,10 @@ class Image(Graphic):
 
     @staticmethod
     def fromZip(key, archive=None):
+        "Load an image from a zip archive, decoding each key only once"
         if archive is None: archive = resolvePath("sc8pr.data")
-        return Image.frombytes(sc8prData(key, archive=archive))
+        load = lambda: Image.frombytes(sc8prData(key, archive=archive), False)
+        return Image(AssetCache.display(AssetCache.load(("zip", archive, key), load)))
 
     def convert(self, alpha=False):
         "Convert images to specified bit size"
@@ -771,6 +856,8 @@ class Image(Graphic):
         "Return a scaled and rotated surface"
         return self._srf.get_surface(self._size, self.angle)
 
+    def _autoMask(self): return self._srf.get_mask(self._size, self.angle)
+
     def contains(self, pos):
         "Determine if the position is contained in the rect and not transparent"
         try: return bool(self.at(pos, self.rect).a)
@@ -789,11 +876,70 @@ class Image(Graphic):
     def copy(self): return Image(self.image.copy())
 
 
+class SharedImage(Graphic):
+    """A lightweight image for scenes with very many copies of the same image;
+    instances share the surface cache of the original Image, use __slots__ for
+    common attributes, and update their rect in place when drawn"""
+    __slots__ = "_srf", "_size", "pos", "anchor", "angle", "canvas", "rect", "__dict__", "__weakref__"
+
+    def __init__(self, image):
+        if not isinstance(image, Image): image = Image(image)
+        self._srf = image._srf
+        self._size = image._size
+        self.pos = 0, 0
+        self.anchor = CENTER
+        self.angle = 0
+        self.canvas = None
+
+    @property
+    def original(self): return self._srf.original
+
+    @property
+    def avgColor(self): return pygame.transform.average_color(self._srf.original)
+
+    @property
+    def image(self): return self._srf.get_surface(self._size, self.angle)
+
+    def _autoMask(self): return self._srf.get_mask(self._size, self.angle)
+
+    def contains(self, pos):
+        try: return bool(self.at(pos, self.rect).a)
+        except: return False
+
+    def calcBlitRect(self, blitSize):
+        cv = self.canvas
+        pos = self.blitPosition(cv.rect.topleft if cv else (0,0), blitSize)
+        try:
+            r = self.rect
+            r.topleft = int(pos[0]), int(pos[1])    # Truncate like pygame.Rect(pos, size)
+            r.size = blitSize
+        except AttributeError:
+            r = self.rect = pygame.Rect(pos, blitSize)
+        return r
+
+
+class SharedSprite(SharedImage, BaseSprite):
+    "A lightweight sprite with a single costume shared with other instances"
+    __slots__ = "vel", "acc", "spin"
+
+    def __init__(self, image):
+        super().__init__(image)
+        self.vel = 0, 0
+        self.acc = None
+        self.spin = 0
+
+
 class Canvas(Graphic):
     _border = rgba("black")
     _clipArea = None
+    _hitGrid = None
+    _gridMin = 32
+    gridSize = 64
     weight = 0
     resizeContent = True
+    cached = False
+    _offscreen = False
+    _texture = _texKey = _texPos = _opaque = None
 
     def __init__(self, image, bg=None):
         self.resetCS()
@@ -808,6 +954,8 @@ class Canvas(Graphic):
             size = bg.size
         self._size = size
         self._items = []
+        self._members = set()
+        self._keys = {}
         self.bg = bg
 
     @property
@@ -885,7 +1033,7 @@ class Canvas(Graphic):
         cv = self.canvas
         r = self.rect
         if self.clipArea: r = r.clip(self.clipArea.move(*r.topleft))
-        return r.clip(cv.clipRect) if cv else r
+        return r.clip(cv.clipRect) if cv and not self._offscreen else r
 
     @property
     def angle(self): return 0
@@ -913,23 +1061,26 @@ class Canvas(Graphic):
             msg = "painting on canvas requires a background image"
             raise AttributeError(msg)
         key, scaled = cs.scaled
-        if scaled is cs.original:
+        if scaled is not cs._owned: # Don't paint on original or shared surfaces
             scaled = scaled.copy()
             cs.scaled = key, scaled
+            cs._owned = scaled
         pygame.draw.line(scaled, c, p1, p2, w)
+        self._painted += 1
 
     def __len__(self): return len(self._items)
 
+    def __iter__(self): return iter(self._items)
+
     def __contains__(self, i):
-        for gr in self._items:
-            if gr is i or getattr(gr, "_name", None) == i: return True
-        return False
+        try: return i in self._members or i in self._keys
+        except TypeError: return False
 
     def __getitem__(self, i):
         if type(i) in (int, slice): return self._items[i]
         if i:
-            for gr in self._items:
-                if getattr(gr, "_name", None) == i: return gr
+            try: return self._keys[i]
+            except (KeyError, TypeError): pass
         raise KeyError("{} contains no items with key '{}'".format(self, i))
 
     def __setitem__(self, key, gr):
@@ -1011,15 +1162,22 @@ class Canvas(Graphic):
                     w, h = g.size
                     g.resize((w * fx, h * fy))
 
+    def calcBlitRect(self, blitSize):
+        if self._offscreen: return pygame.Rect((0, 0), blitSize)
+        return Graphic.calcBlitRect(self, blitSize)
+
     def draw(self, srf=None, mode=3):
         "Draw the canvas to a surface"
+        if self.cached and mode == 3 and srf is not None and not self._offscreen:
+            r = self._drawCached(srf)
+            if r is not None: return r
 
         # Calculate blit rectangle
         if srf is None: srf = self.image
         self.rect = r = self.calcBlitRect(self.size)
 
         # Draw background
-        isSketch = isinstance(self, Sketch)
+        isSketch = isinstance(self, Sketch) and not self.retained
         if mode & 1:
             srf.set_clip(self.clipRect)
             if isinstance(self._bg, Image):
@@ -1033,7 +1191,9 @@ class Canvas(Graphic):
         if mode & 2:
             br = isSketch and self.dirtyRegions is not None
             if br: self.dirtyRegions = []
+            prof = getattr(self, "profiler", None)
             for g in list(self):
+                if prof: t = prof.time()
                 srf.set_clip(self.clipRect)
                 if not hasattr(g, "image") and g.effects:
                     img = g.snapshot()
@@ -1042,7 +1202,9 @@ class Canvas(Graphic):
                     grect = img.draw(srf)
                 else: grect = g.draw(srf)
                 g.rect = grect
-                if br: self.dirtyRegions.append(grect)
+                if prof: prof.drawn(g, t)
+                if br: self.dirtyRegions.append(grect.copy())
+            self._hitGrid = None
 
         # Draw border
         if mode & 1 and self.weight:
@@ -1051,6 +1213,78 @@ class Canvas(Graphic):
         srf.set_clip(None)
         return r
 
+    def _drawCached(self, srf):
+        """Blit the canvas from an offscreen surface that is redrawn only
+        when its content changes; return None if the canvas cannot be cached"""
+        key = self._drawKey() if self._isOpaque() else None
+        if key is None:
+            self._texture = self._texKey = self._texPos = None
+            return None
+        r = self.rect
+        if key != self._texKey:
+            tex = self._texture
+            if tex is None or tex.get_size() != r.size:
+                tex = self._texture = CachedSurface.toDisplay(pygame.Surface(r.size))
+            self._offscreen = True
+            try: self.draw(tex)
+            finally: self._offscreen = False
+            self._texKey = key
+            self._texPos = 0, 0
+            self.rect = r
+
+        # Descendant rects are offset by _texPos from the offscreen surface
+        x, y = self._texPos
+        if (x, y) != r.topleft:
+            self._shift((r.x - x, r.y - y))
+        srf.set_clip(self.clipRect)
+        srf.blit(self._texture, r.topleft)
+        srf.set_clip(None)
+        return r
+
+    def _shift(self, offset):
+        "Move the rects of all descendants from offscreen to onscreen coordinates"
+        dx, dy = offset
+        p = self._texPos
+        if p: self._texPos = p[0] + dx, p[1] + dy
+        for g in self:
+            r = getattr(g, "rect", None)
+            if r is not None: g.rect = r.move(dx, dy)
+            if isinstance(g, Canvas): g._shift(offset)
+        self._hitGrid = None
+
+    def _isOpaque(self):
+        "Check whether the canvas background hides everything beneath it"
+        bg = self._bg
+        if isinstance(bg, Image):
+            bg.config(size=self._size)
+            srf = bg.image
+            o = self._opaque
+            if o is None or o[0] is not srf:
+                w, h = srf.get_size()
+                o = self._opaque = srf, not hasAlpha(srf) or pygame.mask.from_surface(srf, 254).count() == w * h
+            return o[1]
+        return bg is not None and bg.a == 255
+
+    def _ownKey(self):
+        "Key for the canvas background, border and clipping, excluding its content"
+        self.rect = r = self.calcBlitRect(self.size)
+        bg = self._bg
+        if isinstance(bg, Image):
+            bg.config(size=self._size)
+            bg = bg.image
+        c = self._clipArea
+        return tuple(r), bg, self.weight, self._border, c and tuple(c), self._painted
+
+    def _drawKey(self):
+        if self.effects: return None
+        own = self._ownKey()
+        keys = []
+        for g in self._items:
+            k = g._drawKey()
+            if k is None: return None
+            keys.append((g, k))
+        return own + (tuple(keys),)
+
     def snapshot(self):
         "Capture the canvas as an Image instance"
         srf = pygame.Surface(self.size, pygame.SRCALPHA)
@@ -1083,9 +1317,21 @@ class Canvas(Graphic):
             else: self += gr
         return self
 
+    def _getGrid(self):
+        "Return the hit-test grid, building it when first needed after drawing"
+        grid = self._hitGrid
+        if grid is None:
+            n = self.gridSize
+            if n and len(self._items) >= self._gridMin:
+                grid = self._hitGrid = RectGrid(n)
+                for g in self: grid.add(g, getattr(g, "rect", None))
+        return grid
+
     def objectAt(self, pos, includeAll=False):
+        "Find the topmost graphic at the specified position"
+        grid = self._getGrid()
         obj = self
-        for g in self:
+        for g in (self if grid is None else grid.at(pos)):
             try: # Objects added but not yet blitted have no rect
                 if (includeAll or g.hoverable) and g.contains(pos):
                     obj = g.objectAt(pos) if isinstance(g, Canvas) else g
@@ -1141,8 +1387,24 @@ class Sketch(Canvas):
     frameRate = 60
     _fixedAspect = True
     dirtyRegions = []
+    dirtyGap = 8
+    dirtyMax = 32
     resizeTrigger = False
-    _sys_cursor = pygame.mouse.get_cursor()
+    headless = False
+    simRate = None
+    maxSteps = 8
+    skipStatic = False
+    retained = False
+    profiler = None
+    recorder = player = None
+    coalesce = False
+    _async = False
+    _simTime = 0
+    _activeVersion = None
+    _retainedKeys = None
+    _dirtyClip = None
+    _sys_cursor = None
+    _banner = "sc8pr {}.{}.{}: https://dmaccarthy.github.io/sc8pr".format(*version)
 
     def __init__(self, size=(512,288)):
         super().__init__(size, "white")
@@ -1171,10 +1433,17 @@ class Sketch(Canvas):
 
     @property
     def timeFactor(self):
-        if self.frameCount == 1: return 1
+        if self.simRate: return self.frameRate / self.simRate
+        if self.frameCount == 1 or self.headless: return 1
         t = self.frameRate * self._clock.get_time() / 1000
         return min(t, 5.0)
 
+    @property
+    def stepTime(self):
+        "Simulated time in seconds for each call to update"
+        t = self.timeFactor if (self.simRate and self.realTime) else 1
+        return t / self.frameRate
+
     def onquit(self, ev): self.quit = True
 
     @property
@@ -1188,8 +1457,7 @@ class Sketch(Canvas):
             size = self.size
             size = self._aspectSize(size, size)
             if size != self._size: self.resize(size)
-        if self.dirtyRegions is not None:
-            self.dirtyRegions = [pygame.Rect((0,0), self._size)]
+        self._fullRedraw()
 
     @property
     def cursor(self): return pygame.mouse.get_cursor()
@@ -1256,11 +1524,10 @@ class Sketch(Canvas):
         else:
             mode = self._pygameMode(mode)
             self._mode = mode
-        self.image = _pd.set_mode(size, mode)
+        self.image = self._setMode(size, mode)
         super().resize(self.size)
         self._size = self.size
-        if self.dirtyRegions is not None:
-            self.dirtyRegions = [pygame.Rect((0,0), self._size)]
+        self._fullRedraw()
         evMgr = self.evMgr
         ev = getattr(self, "_resize_ev", None)
         self._resize_ev = None
@@ -1268,25 +1535,98 @@ class Sketch(Canvas):
             ev = pygame.event.Event(pygame.USEREVENT, focus=evMgr.focus, hover=evMgr.hover)
         if ev: evMgr.handle(self, "onresize", ev)
 
+    def profile(self, **kwargs):
+        "Enable per-frame timing instrumentation (see sc8pr.misc.profile)"
+        from sc8pr.misc.profile import Profiler
+        self.profiler = Profiler(**kwargs)
+        return self.profiler
+
+    def record(self, fn, seed=None):
+        "Record events and the random seed to a file (see sc8pr.misc.record)"
+        from sc8pr.misc.record import Recorder
+        self.recorder = Recorder(fn, seed, self._size)
+        return self
+
+    def replay(self, fn, render=1, until=None):
+        "Replay a recorded session in a headless simulation at the recorded size"
+        from sc8pr.misc.record import Replay
+        self.player = Replay(fn)
+        size = self.player.header.get("size")
+        if size: self._size = tuple(size)
+        self.simulate(self.player.frames, until, render)
+        self.player = None
+        return self
+
 # Drawing methods
 
     def play(self, caption="sc8pr", icon=None, mode=True):
         "Initialize pygame and run the main drawing / event handling loop"
+        if Sketch._banner:
+            print(Sketch._banner)
+            Sketch._banner = None
+        self.headless = False
+        self._start(caption, icon, mode)
+        while not self.quit:
+            try: self._frame()
+            except: logError()
+        return self._stop()
+
+    async def playAsync(self, caption="sc8pr", icon=None, mode=True):
+        """Coroutine version of play that awaits between frames instead of
+        blocking, so that other tasks can share the asyncio event loop"""
+        import asyncio
+        from time import perf_counter
+        if Sketch._banner:
+            print(Sketch._banner)
+            Sketch._banner = None
+        self.headless = False
+        self._async = True
+        self._start(caption, icon, mode)
+        t = perf_counter()
+        try:
+            while not self.quit:
+                try: self._frame()
+                except: logError()
+                t += 1 / self.frameRate
+                now = perf_counter()
+                if t < now: t = now
+                await asyncio.sleep(t - now)
+        finally: self._async = False
+        return self._stop()
+
+    def simulate(self, frames=None, until=None, render=1):
+        """Run the sketch on an offscreen surface without a display window or
+        frame rate limit; draw only every nth frame as specified by 'render'"""
+        self.headless = True
+        self._start(None, None, 0)
+        while not (self.quit or frames is not None and self.frameCount >= frames):
+            try:
+                f = self.frameCount + 1
+                self._frame(bool(render) and (f == 1 or f % render == 0))
+                if until and until(self): self.quit = True
+            except: logError()
+        return self._stop()
 
-        # Initialize
-        if not pygame.get_init(): pygame.init()
+    def _start(self, caption, icon, mode):
+        "Initialize pygame, create the drawing surface and run setup"
+        if self.headless: _pd.init()
+        else:
+            if not pygame.get_init(): pygame.init()
+            pygame.key.set_repeat(400, 80)
         self._clock = pygame.time.Clock()
-        _pd.set_caption(caption)
-        try:
-            try: icon = Image(icon)
-            except: icon = Image.fromZip("alien")
-            _pd.set_icon(icon.config(width=64).image)
-        except: logError()
+        if not self.headless:
+            if Sketch._sys_cursor is None: Sketch._sys_cursor = pygame.mouse.get_cursor()
+            _pd.set_caption(caption)
+            try:
+                try: icon = Image(icon)
+                except: icon = Image.fromZip("alien")
+                _pd.set_icon(icon.config(width=64).image)
+            except: logError()
         w, h = self._size
         if self._fixedAspect: self._fixedAspect = w / h
         mode = self._pygameMode(mode)
         self._mode = mode
-        self.image = _pd.set_mode(self._size, mode)
+        self.image = self._setMode(self._size, mode)
         if self.image.get_bitsize() not in (24, 32):
             print("Warning: Display may not be RGB/RGBA", file=sys.stderr)
         self.key = None
@@ -1300,31 +1640,183 @@ class Sketch(Canvas):
                 if hasattr(main, "setup"): main.setup(self)
         except: logError()
 
-        # Drawing/event loop
-        while not self.quit:
-            try:
-                self.frameCount += 1
-                br = self.dirtyRegions
-                flip = br is None
-                self.draw()
-                if not flip:
-                    br += self.dirtyRegions
-                    flip = self._largeArea()
-
-                # _clock.tick was here in v2... better to update display first?
-                if flip: _pd.flip()
-                else: _pd.update(br)
-                self._clock.tick(self.frameRate)
-
-                for gr in list(self.everything()):
-                    if hasattr(gr, "_animScript"): gr.animate()
-                    gr.update(customEv(target=gr, handler="ondraw"))
-                    r = gr.removeFrame
-                    if r and self.frameCount >= r: gr.remove()
-                self.update(customEv(target=self, handler="ondraw"))
-                self._evHandle()
-            except: logError()
+    def _setMode(self, size, mode):
+        "Create the display surface, or an offscreen surface if headless"
+        if self.headless: return pygame.Surface(size)
+        return _pd.set_mode(size, mode)
+
+    def _frame(self, render=True):
+        "Draw, update and handle events for one frame"
+        if self.simRate: return self._fixedFrame(render)
+        self.frameCount += 1
+        prof = self.profiler
+        if prof: prof.begin()
+        if render: self._render()
+        self._clock.tick(0 if self.headless or self._async else self.frameRate)
+        if prof: prof.lap("tick")
+        self._updateAll()
+        if prof: prof.lap("update")
+        self._evHandle()
+        if prof:
+            prof.lap("events")
+            prof.end(self)
+
+    def _fixedFrame(self, render=True):
+        "Run the simulation at a fixed rate and draw when at least one step has run"
+        dt = 1 / self.simRate
+        if self.headless: t = dt
+        else: t = self._simTime + (self._clock.get_time() / 1000 if self.frameCount else dt)
+        n = 0
+        prof = self.profiler
+        if prof: prof.begin()
+        while t >= dt and n < self.maxSteps:
+            self.frameCount += 1
+            self._updateAll()
+            t -= dt
+            n += 1
+        if prof: prof.lap("update")
+        self._simTime = min(t, dt)
+        if render and n: self._render()
+        self._clock.tick(0 if self.headless or self._async else self.frameRate)
+        if prof: prof.lap("tick")
+        self._evHandle()
+        if prof:
+            prof.lap("events")
+            prof.end(self)
+
+    def _fullRedraw(self):
+        "Redraw the entire sketch on the next frame"
+        self._retainedKeys = None
+        if self.dirtyRegions is not None:
+            self.dirtyRegions = [pygame.Rect((0,0), self._size)]
 
+    @property
+    def clipRect(self):
+        r = Canvas.clipRect.fget(self)
+        d = self._dirtyClip
+        return r.clip(d) if d else r
+
+    def _render(self):
+        "Draw the sketch and update the display"
+        if self.retained: return self._renderRetained()
+        br = self.dirtyRegions
+        flip = br is None
+        self.draw()
+        if not flip:
+            br = self._mergeRects(br + self.dirtyRegions)
+            flip = br is None
+        prof = self.profiler
+        if prof: prof.lap("draw")
+
+        # _clock.tick was here in v2... better to update display first?
+        if not self.headless:
+            if flip: _pd.flip()
+            else: _pd.update(br)
+        if prof: prof.lap("display")
+
+    def _renderRetained(self):
+        "Redraw only the regions affected by graphics that have changed since the last frame"
+        own = self._ownKey()
+        keys = {g: g._drawKey() for g in self._items}
+        prev = self._retainedKeys
+        if prev and prev[0] == own:
+            prev = prev[1]
+            if [g for g in prev if g in keys] != [g for g in keys if g in prev]:
+                prev = None
+        else: prev = None
+
+        # Find changed graphics
+        partial = prev is not None and None not in keys.values()
+        dirty = None
+        if prev is not None:
+            dirty = []
+            changed = []
+            for g, k in keys.items():
+                p = prev.get(g)
+                if p is None or k is None or p[0] != k:
+                    if p: dirty.append(pygame.Rect(p[1]))
+                    if k: dirty.append(pygame.Rect(k[0]))
+                    changed.append(g)
+            for g, p in prev.items():
+                if g not in keys: dirty.append(pygame.Rect(p[1]))
+
+        # Draw and update display
+        if partial:
+            dirty = self._mergeRects(dirty)
+            if dirty: self._drawPartial(self.image, dirty, keys, changed)
+        if not partial or dirty is None:
+            self.draw()
+            if prev is not None and not partial:
+                dirty = self._mergeRects(dirty + [g.rect for g in changed if keys[g] is None])
+        self._retainedKeys = own, {g: (k, tuple(g.rect)) for g, k in keys.items()}
+        prof = self.profiler
+        if prof: prof.lap("draw")
+        if not self.headless:
+            if dirty is None: _pd.flip()
+            elif dirty: _pd.update(dirty)
+        if prof: prof.lap("display")
+
+    def _mergeRects(self, rects):
+        "Coalesce dirty rects for drawing and display update; None means update everything"
+        return mergeRects(rects, self.rect, self.dirtyGap, self.dirtyMax)
+
+    def _drawPartial(self, srf, rects, keys, changed):
+        "Recomposite the sketch within the specified rects only"
+        bg = self._bg
+        items = [(g, pygame.Rect(k[0])) for g, k in keys.items()]
+        for g in changed: g.rect = pygame.Rect(keys[g][0])
+        prof = self.profiler
+        for r in rects:
+            self._dirtyClip = r
+            srf.set_clip(r)
+            if isinstance(bg, Image): srf.blit(bg.image.subsurface(r), r.topleft)
+            elif bg: srf.fill(bg)
+            for g, gr in items:
+                if gr.colliderect(r):
+                    if prof: t = prof.time()
+                    srf.set_clip(self.clipRect)
+                    g.rect = g.draw(srf)
+                    if prof: prof.drawn(g, t)
+            if self.weight:
+                srf.set_clip(r)
+                drawBorder(srf, self.border, self.weight, self.rect)
+        self._dirtyClip = None
+        srf.set_clip(None)
+
+        # Update hit-test grid if one has been built
+        grid = self._hitGrid
+        if grid is not None:
+            if len(grid) == len(items):
+                for g in changed: grid.add(g, g.rect)
+            else: self._hitGrid = None
+
+    def _updateAll(self):
+        """Call the update method of every graphic and of the sketch; with
+        skipStatic, ondraw handlers must be attached using bind or config"""
+        if self.skipStatic:
+            v = Graphic._version
+            if self._activeVersion != v:
+                self._activeList = [gr for gr in self.everything() if gr._active]
+                self._activeVersion = v
+            items = self._activeList
+        else: items = list(self.everything())
+        ev = customEv()
+        d = ev.dict
+        for gr in items:
+            if hasattr(gr, "_animScript"): gr.animate()
+            d.clear()
+            d.update(target=gr, handler="ondraw")
+            gr.update(ev)
+            r = gr._removeFrame
+            if r and self.frameCount >= r: gr.remove()
+        self.update(customEv(target=self, handler="ondraw"))
+
+    def _stop(self):
+        "Shut down pygame after the main loop exits"
+        for obj in (self.profiler, self.recorder):
+            if obj:
+                try: obj.stop(self)
+                except: logError()
         pygame.quit()
         mod = sys.modules.get("sc8pr.text")
         if mod: mod.Font.dumpCache()
@@ -1333,10 +1825,13 @@ class Sketch(Canvas):
     def _evHandle(self):
         "Handle events in the pygame event queue"
         resized = False
-        for ev in pygame.event.get():
+        if self.player: events = self.player.events(self.frameCount)
+        else: events = pygame.event.get() if _pd.get_init() else ()
+        if self.recorder: self.recorder.write(self.frameCount, events)
+        if self.coalesce and events: events = coalesce(events)
+        for ev in events:
             try:
-                if ev.type in (pygame.VIDEOEXPOSE, WINEXPOSED) and self.dirtyRegions is not None:
-                    self.dirtyRegions = [pygame.Rect((0,0), self._size)]
+                if ev.type in (pygame.VIDEOEXPOSE, WINEXPOSED): self._fullRedraw()
                 if ev.type not in (pygame.VIDEORESIZE, SIZECHANGED):
                     self.evMgr.dispatch(ev)
                 elif not resized:
@@ -1359,14 +1854,3 @@ class Sketch(Canvas):
                 try: # Subsurface may be outside drawing surface
                     srf.blit(self._bg.image.subsurface(blitRect), blitRect.topleft)
                 except: pass
-
-    def _largeArea(self):
-        "Determine if dirtyRegions area exceeds total sketch area"
-        screen = self.rect
-        large = screen.width * screen.height
-        area = 0
-        for r in self.dirtyRegions:
-            r = r.clip(screen)
-            area += r.width * r.height
-            if area >= large: return True
-        return False
@@ -16,6 +16,23 @@
 # along with "sc8pr".  If not, see <http://www.gnu.org/licenses/>.
 
 import pygame
+import sc8pr
+
+_names = {}
+_classHandlers = {}
+
+class HandlerMeta(type):
+    """Metaclass for Graphic that discards cached class handler lookups when
+    a handler or base class is changed; handlers added later to a mixin that
+    is not a Graphic subclass are not detected"""
+
+    def __setattr__(cls, name, val):
+        type.__setattr__(cls, name, val)
+        if name[:2] == "on" or name == "__bases__": _classHandlers.clear()
+
+    def __delattr__(cls, name):
+        type.__delattr__(cls, name)
+        if name[:2] == "on": _classHandlers.clear()
 
 class EventManager:
     "Process events (except VIDEORESIZE) from the pygame event queue"
@@ -26,6 +43,7 @@ class EventManager:
         self.focus = sk
         self.hover = sk
         self.drag = None
+        self._hoverKey = self._hoverPathCache = None
 
     def dispatch(self, ev):
         "Process one pygame event"
@@ -40,15 +58,14 @@ class EventManager:
         else: other = True
 
         # Determine 'hover' graphic
-        path = sk.objectAt(sk.mouse.pos).path
-        if not path: path = [sk]
+        path = self._hoverPath(sk)
         self._oldHover = self.hover
         self.hover = path[0]
         setattr(ev, "hover", path[0])
     
         # Set 'focus' graphic and handler name
         setattr(ev, "focus", self.focus)
-        name = "on" + pygame.event.event_name(ev.type).lower()
+        name = _handlerName(ev.type)
 
         # Call sk.onevent
         if hasattr(sk, "onevent"):
@@ -91,7 +108,7 @@ class EventManager:
             self._overOut(path, ev)
             drag = False
             if sum(ev.buttons): # Dragging
-                current = _find(self._oldHover.path, "ondrag") \
+                current = self._resolve(self._oldHover.path, "ondrag") \
                     if self.drag is None else self.drag
                 if current is not None:
                     if self.drag is not current: self.drag = current
@@ -104,17 +121,42 @@ class EventManager:
 #             delattr(ev, "target")  # Removed!!!
             sk.onhandled(ev)
 
+    def _hoverPath(self, sk):
+        """Hit test at the mouse position; reuse the result within a frame if
+        coalescing, unless the graphics changed or the hover target moved"""
+        pos = sk.mouse.pos
+        if sk.coalesce:
+            key = sk.frameCount, tuple(pos), sc8pr.Graphic._version
+            path = self._hoverPathCache
+            if path and key + _hitState(path[0]) == self._hoverKey: return path
+        else: key = None
+        path = sk.objectAt(pos).path
+        if not path: path = [sk]
+        self._hoverKey = key and key + _hitState(path[0])
+        self._hoverPathCache = path
+        return path
+
     def handle(self, path, eventName, ev):
         "Locate and call the appropriate event handler"
         if type(path) is not list: path = path.path
         setattr(ev, "target", path[0])
         setattr(ev, "handler", eventName)
-        current = _find(path, eventName)
+        current = self._resolve(path, eventName)
         handle = current is not None
 #         if self.debug:
 #             print("Handling  :" if handle else "No handler:", pygame.event.event_name(ev.type) if self.debug == 1 else ev)
         if handle: return getattr(current, eventName)(ev)
 
+    def _resolve(self, path, eventName):
+        "Find the object in the path that handles the event"
+        for g in path:
+            d = getattr(g, "__dict__", None)
+            if d and eventName in d: return g
+            key = type(g), eventName
+            h = _classHandlers.get(key)
+            if h is None: h = _classHandlers[key] = hasattr(key[0], eventName)
+            if h: return g
+
     def _dragRelease(self, ev):
         "Handle RELEASE events for graphic being dragged"
         drag = self.drag
@@ -137,8 +179,39 @@ class EventManager:
             self.handle(obj, "onmouseover", ev)
 
 
-def _find(p, a):
-    "Find an object in the path that has the given attribute"
-    for i in range(len(p)):
-        g = p[i]
-        if hasattr(g, a): return g
+def _hitState(g):
+    "Return the attributes that determine whether a graphic contains a point"
+    r = getattr(g, "rect", None)
+    return (None if r is None else tuple(r)), getattr(g, "angle", 0)
+
+def _handlerName(t):
+    "Return the handler name for an event type, e.g. 'onmousemotion'"
+    name = _names.get(t)
+    if name is None:
+        name = _names[t] = "on" + pygame.event.event_name(t).lower()
+    return name
+
+def coalesce(events):
+    """Merge consecutive MOUSEMOTION events with the same buttons (summing
+    'rel') and discard KEYDOWN events for a key that is already down in
+    the same batch, so auto-repeat occurs at most once per frame"""
+    result = []
+    held = set()
+    motion = None
+    for ev in events:
+        t = ev.type
+        if t == pygame.MOUSEMOTION:
+            if motion is not None and result[-1] is motion and motion.buttons == ev.buttons:
+                d = motion.dict
+                d.update(ev.dict, rel=(d["rel"][0] + ev.rel[0], d["rel"][1] + ev.rel[1]),
+                    coalesced=d.get("coalesced", 1) + 1)
+                motion = result[-1] = pygame.event.Event(t, d)
+                continue
+            motion = ev
+        elif t == pygame.KEYDOWN:
+            k = ev.key
+            if k in held: continue
+            held.add(k)
+        elif t == pygame.KEYUP: held.discard(ev.key)
+        result.append(ev)
+    return result
@@ -0,0 +1,87 @@
+# Copyright 2015-2023 D.G. MacCarthy <https://dmaccarthy.github.io/sc8pr>
+#
+# This file is part of "sc8pr".
+#
+# "sc8pr" is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# "sc8pr" is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with "sc8pr".  If not, see <http://www.gnu.org/licenses/>.
+
+
+class RectGrid:
+    "A uniform grid for locating objects by their bounding rectangles"
+    maxCells = 256
+
+    def __init__(self, size=64):
+        self.size = size
+        self._cells = {}
+        self._where = {}
+        self._loose = []
+        self._seq = 0
+
+    def __len__(self): return len(self._where)
+
+    def _keys(self, r):
+        "List the cells that overlap a rectangle, or None if there are too many"
+        s = self.size
+        x, y, w, h = r
+        x0, y0 = int(x // s), int(y // s)
+        x1, y1 = int((x + w - 1) // s), int((y + h - 1) // s)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > self.maxCells: return None
+        return [(i, j) for i in range(x0, x1 + 1) for j in range(y0, y1 + 1)]
+
+    def add(self, obj, rect=None):
+        "Add (or move) an object; objects without a rect match every query"
+        w = self._where.get(obj)
+        if w:
+            item = w[0]
+            self.discard(obj)
+        else:
+            item = self._seq, obj
+            self._seq += 1
+        keys = None if rect is None else self._keys(rect)
+        if keys is None: self._loose.append(item)
+        else:
+            cells = self._cells
+            for k in keys:
+                if k in cells: cells[k].append(item)
+                else: cells[k] = [item]
+        self._where[obj] = item, keys
+
+    def discard(self, obj):
+        "Remove an object from the grid if present"
+        w = self._where.pop(obj, None)
+        if w:
+            item, keys = w
+            if keys is None: self._loose.remove(item)
+            else:
+                cells = self._cells
+                for k in keys:
+                    c = cells[k]
+                    c.remove(item)
+                    if not c: del cells[k]
+
+    def at(self, pos):
+        "List objects whose rect may contain the point, in the order added"
+        s = self.size
+        items = self._cells.get((int(pos[0] // s), int(pos[1] // s)), [])
+        if self._loose: items = items + self._loose
+        return [i[1] for i in sorted(items)]
+
+    def near(self, rect):
+        "List objects whose rect may overlap the rectangle, in the order added"
+        keys = self._keys(rect)
+        if keys is None: items = [w[0] for w in self._where.values()]
+        else:
+            cells = self._cells
+            items = set(self._loose)
+            for k in keys: items.update(cells.get(k, ()))
+        return [i[1] for i in sorted(items)]
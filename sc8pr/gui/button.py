@@ -155,6 +155,10 @@ class Button(Canvas):
         self._bg = self._options[self._status]
         return Canvas.draw(self, srf, mode)
 
+    def _drawKey(self):
+        self._bg = self._options[self._status]
+        return Canvas._drawKey(self)
+
     def snapshot(self):
         self._bg = self._options[self._status]
         return Canvas.snapshot(self)
@@ -77,6 +77,15 @@ class TextInput(Text):
         self.cursorStart = self.sketch.frameCount
 
     def draw(self, srf):
+        self._cursorUpdate()
+        return super().draw(srf)
+
+    def _drawKey(self):
+        self._cursorUpdate()
+        return self._imageKey()
+
+    def _cursorUpdate(self):
+        "Blink the cursor while the input has the focus"
         if self.focussed:
             sk = self.sketch
             try: n = (sk.frameCount - self.cursorStart) / sk.frameRate
@@ -90,7 +99,6 @@ class TextInput(Text):
         elif self.cursorStatus:
             self.cursorStatus = False
             self.stale = True
-        return super().draw(srf)
 
     def render(self):
         "Render the text as an Image"
@@ -0,0 +1,215 @@
+# Copyright 2015-2023 D.G. MacCarthy <https://dmaccarthy.github.io/sc8pr>
+#
+# This file is part of "sc8pr".
+#
+# "sc8pr" is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# "sc8pr" is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with "sc8pr".  If not, see <http://www.gnu.org/licenses/>.
+
+
+import pygame
+from sc8pr import Canvas, Image, CENTER, HORIZONTAL, VERTICAL, BOTH, REMOVE
+from sc8pr.util import drawBorder
+
+try:
+    import numpy as np
+except:
+    np = None
+
+
+class Particles(Canvas):
+    """A canvas that animates many copies of one image, storing the
+    kinematic state of the particles in numpy arrays"""
+    wrap = REMOVE
+    bounce = bounceType = 0
+    acc = None
+    drag = 0
+    angleStep = 5
+    _arrays = "positions", "velocities", "angles", "spins"
+
+    def __init__(self, size, image, bg=None):
+        if np is None: raise ImportError("Particles requires numpy")
+        super().__init__(size, bg)
+        self.particle = image if isinstance(image, Image) else Image(image)
+        self.positions = np.zeros((0, 2))
+        self.velocities = np.zeros((0, 2))
+        self.angles = np.zeros(0)
+        self.spins = np.zeros(0)
+        self._rotated = None, {}
+
+    @property
+    def count(self): return len(self.positions)
+
+    def emit(self, pos, vel=(0, 0), angle=0, spin=0):
+        "Add particles; pos and vel may be a single vector or an array of vectors"
+        pos = np.array(pos, float).reshape(-1, 2)
+        n = len(pos)
+        vel = np.broadcast_to(np.array(vel, float).reshape(-1, 2), (n, 2))
+        angle = np.broadcast_to(np.array(angle, float), (n,))
+        spin = np.broadcast_to(np.array(spin, float), (n,))
+        for a, x in zip(self._arrays, (pos, vel, angle, spin)):
+            setattr(self, a, np.concatenate((getattr(self, a), x)))
+        return self
+
+    def discard(self, index):
+        "Remove particles by index or boolean mask"
+        keep = np.ones(self.count, bool)
+        keep[index] = False
+        self._keep(keep)
+        return self
+
+    def _keep(self, keep):
+        for a in self._arrays: setattr(self, a, getattr(self, a)[keep])
+
+# Motion
+
+    def update(self, ev):
+        if self.count:
+            if self.bounce: self._bounce()
+            wrapped = self._wrap() if self.wrap else None
+            self._kinematics(wrapped)
+        if hasattr(self, "ondraw"): self.ondraw(ev)
+
+    def _bounce(self):
+        "Bounce particles from the edges of the canvas"
+        x, y = self.positions.T
+        vx, vy = self.velocities.T
+        w, h = self.size
+        b = self.bounce
+        if self.bounceType == 0:
+            r = self.particle.radius
+            x0 = y0 = r
+            x1, y1 = w - r, h - r
+            left, right = x < x0, x > x1
+            top, bottom = y < y0, y > y1
+        else:
+            pw, ph = self.particle.size
+            left, right = x - pw / 2 < 0, x + pw / 2 >= w
+            top, bottom = y - ph / 2 < 0, y + ph / 2 >= h
+        where = np.full(self.count, CENTER)
+        if b & HORIZONTAL:
+            lo, hi = left & (vx < 0), right & (vx > 0)
+            vx[lo | hi] *= -1
+            where[lo] -= 1
+            where[hi] += 1
+        if b & VERTICAL:
+            lo, hi = top & (vy < 0), bottom & (vy > 0)
+            vy[lo | hi] *= -1
+            where[lo] -= 4
+            where[hi] += 4
+        hit = np.flatnonzero(where != CENTER)
+        if len(hit): self.bubble("onbounce", {"index":hit, "where":where[hit]})
+
+    def _wrap(self):
+        "Wrap or remove particles that have left the canvas"
+        w = self.wrap
+        if w is True: w = BOTH
+        x, y = self.positions.T
+        vx, vy = self.velocities.T
+        pw, ph = self.particle.size
+        W, H = self.size
+        left, right = x + pw / 2 < 0, x - pw / 2 >= W
+        top, bottom = y + ph / 2 < 0, y - ph / 2 >= H
+        out = left | right | top | bottom
+        where = np.full(self.count, CENTER)
+        remove = np.zeros(self.count, bool)
+        if w & 5: # HORIZONTAL | REMOVE_X
+            lo, hi = out & left & (vx <= 0), out & right & (vx >= 0)
+            where[lo] -= 1
+            where[hi] += 1
+            if w & 4: remove |= lo | hi
+            else:
+                x[lo] += pw + W
+                x[hi] -= pw + W
+        if w & 10: # VERTICAL | REMOVE_Y
+            lo, hi = out & top & (vy <= 0), out & bottom & (vy >= 0)
+            where[lo] -= 4
+            where[hi] += 4
+            if w & 8: remove |= lo | hi
+            else:
+                y[lo] += ph + H
+                y[hi] -= ph + H
+        if remove.any():
+            keep = ~remove
+            self._keep(keep)
+            where = where[keep]
+        wrapped = where != CENTER
+        hit = np.flatnonzero(wrapped)
+        if len(hit): self.bubble("onwrap", {"index":hit, "where":where[hit]})
+        return wrapped
+
+    def _kinematics(self, skip=None):
+        "Update motion based on velocities, spins, acc, and drag"
+        t = self.timeFactor
+        p, v = self.positions, self.velocities
+        m = slice(None) if skip is None or len(skip) != len(p) else ~skip
+        acc = self.acc
+        if acc is not None:
+            dv = t * np.array(acc, float)
+            p[m] += (v[m] + dv / 2) * t
+            v[m] += dv
+        else: p[m] += v[m] * t
+        s = self.spins
+        if s.any(): self.angles[m] = (self.angles[m] + s[m] * t) % 360
+        d = self.drag
+        if d:
+            if type(d) in (int, float): s = d
+            else: d, s = d
+            v *= 1 - d
+            self.spins *= 1 - s
+
+# Drawing
+
+    def _blitList(self, offset):
+        "Create a sequence of surfaces and positions for Surface.blits"
+        srf = self.particle.image
+        a = self.angles
+        if a.any():
+            step = self.angleStep
+            a = (np.round(a / step) * step % 360) if step else a
+            base, cache = self._rotated
+            if base is not srf:
+                cache = {}
+                self._rotated = srf, cache
+            seq = []
+            for angle in np.unique(a).tolist():
+                s = cache.get(angle)
+                if s is None:
+                    s = pygame.transform.rotate(srf, -angle) if angle else srf
+                    cache[angle] = s
+                seq.extend(self._blitPos(s, self.positions[a == angle], offset))
+            return seq
+        return self._blitPos(srf, self.positions, offset)
+
+    @staticmethod
+    def _blitPos(srf, pos, offset):
+        w, h = srf.get_size()
+        pos = np.round(pos + (offset[0] - w / 2, offset[1] - h / 2)).astype(int).tolist()
+        return [(srf, p) for p in pos]
+
+    def draw(self, srf=None, mode=3):
+        if srf is None: srf = self.image
+        r = Canvas.draw(self, srf, mode)
+        if mode & 2 and self.count:
+            srf.set_clip(self.clipRect)
+            srf.blits(self._blitList(r.topleft), False)
+            if mode & 1 and self.weight:
+                drawBorder(srf, self.border, self.weight, r)
+            srf.set_clip(None)
+        return r
+
+    def _drawKey(self): return None
+
+    def snapshot(self):
+        img = Canvas.snapshot(self)
+        if self.count: img.image.blits(self._blitList((0, 0)), False)
+        return img
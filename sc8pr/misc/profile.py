@@ -0,0 +1,147 @@
+# Copyright 2015-2023 D.G. MacCarthy <https://dmaccarthy.github.io/sc8pr>
+#
+# This file is part of "sc8pr".
+#
+# "sc8pr" is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# "sc8pr" is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with "sc8pr".  If not, see <http://www.gnu.org/licenses/>.
+
+"""Per-frame timing instrumentation for sketches:
+
+    sk.profile(file="profile.json")
+    sk += sk.profiler.overlay()
+
+Top-level phases are 'draw', 'display', 'tick', 'update' and 'events'. Nested
+timings are also recorded for each top-level graphic ('draw:<name>'), each
+effect ('effect:<class>') and robot sensor updates ('sensors')."""
+
+import json, csv
+from time import perf_counter
+from collections import deque
+from sc8pr.util import logError
+
+
+class Profiler:
+    window = 300
+    interval = 30
+    callback = None
+    file = None
+    _overlay = None
+
+    time = staticmethod(perf_counter)
+
+    def __init__(self, **kwargs):
+        self._stats = {}
+        self._current = {}
+        self.frames = 0
+        self._t = self._t0 = None
+        self.config(**kwargs)
+
+    def config(self, **kwargs):
+        for k, v in kwargs.items(): setattr(self, k, v)
+        return self
+
+    def reset(self):
+        self._stats = {}
+        self.frames = 0
+        return self
+
+# Recording
+
+    def begin(self):
+        "Start timing a frame"
+        self._current = {}
+        self._t = self._t0 = perf_counter()
+
+    def lap(self, key):
+        "Add the time since the previous lap to a top-level phase"
+        t = perf_counter()
+        d = self._current
+        d[key] = d.get(key, 0) + t - self._t
+        self._t = t
+
+    def add(self, key, t0):
+        "Add the time since t0 to a nested timing"
+        d = self._current
+        d[key] = d.get(key, 0) + perf_counter() - t0
+
+    def drawn(self, gr, t0):
+        "Record the time to draw a top-level graphic"
+        name = gr.name
+        self.add("draw:" + (str(name) if name is not None else type(gr).__name__), t0)
+
+    def end(self, sk):
+        "Finish timing a frame and update the rolling statistics"
+        if self._t0 is None: return
+        d = self._current
+        d["frame"] = perf_counter() - self._t0
+        self._t0 = None
+        stats = self._stats
+        for k in d:
+            if k not in stats: stats[k] = deque([0] * min(self.frames, self.window), self.window)
+        for k, s in stats.items(): s.append(d.get(k, 0))
+        self.frames += 1
+        if self.frames % self.interval == 0:
+            if self._overlay: self._overlay.config(data=self.summary())
+            if self.callback:
+                try: self.callback(self)
+                except: logError()
+
+    def stop(self, sk=None):
+        "Called when the sketch exits; dump statistics if a file was specified"
+        if self.file: self.dump(self.file)
+
+# Statistics
+
+    @staticmethod
+    def _percentile(s, p):
+        return s[min(len(s) - 1, int(p * len(s)))]
+
+    def stats(self):
+        "Return p50, p95, max and mean timings (ms) over the rolling window"
+        result = {}
+        pc = self._percentile
+        for k, s in self._stats.items():
+            if s:
+                n = len(s)
+                s = sorted(s)
+                result[k] = {"p50": 1000 * pc(s, 0.5), "p95": 1000 * pc(s, 0.95),
+                    "max": 1000 * s[-1], "mean": 1000 * sum(s) / n}
+        return result
+
+    def summary(self, lines=8):
+        "Text summary of the slowest timings by p95"
+        stats = sorted(self.stats().items(), key=lambda x: -x[1]["p95"])
+        text = ["{:<16}{:>7}{:>7}{:>7}".format("ms", "p50", "p95", "max")]
+        for k, s in stats[:lines]:
+            text.append("{:<16}{p50:7.2f}{p95:7.2f}{max:7.2f}".format(k[:16], **s))
+        return "\n".join(text)
+
+    def overlay(self, **kwargs):
+        "Create a Text graphic that displays the summary"
+        from sc8pr.text import Text, Font
+        attr = {"font": Font.mono(), "fontSize": 12, "bg": "#ffffffc0", "padding": 4, "anchor": 0, "pos": (4, 4)}
+        attr.update(kwargs)
+        self._overlay = Text(self.summary()).config(**attr)
+        return self._overlay
+
+    def dump(self, fn):
+        "Save statistics as CSV or JSON depending on the file extension"
+        stats = self.stats()
+        cols = "p50", "p95", "max", "mean"
+        with open(fn, "w", newline="") as f:
+            if fn.lower().endswith(".csv"):
+                w = csv.writer(f)
+                w.writerow(("key",) + cols)
+                for k, s in stats.items(): w.writerow([k] + [round(s[c], 4) for c in cols])
+            else: json.dump({"frames": self.frames, "units": "ms", "stats": stats}, f, indent=1)
+        return self
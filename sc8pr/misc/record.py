@@ -0,0 +1,92 @@
+# Copyright 2015-2023 D.G. MacCarthy <https://dmaccarthy.github.io/sc8pr>
+#
+# This file is part of "sc8pr".
+#
+# "sc8pr" is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# "sc8pr" is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with "sc8pr".  If not, see <http://www.gnu.org/licenses/>.
+
+"""Record the events of an interactive session and replay them headlessly:
+
+    sk.record("session.s8e").play()
+    ...
+    sk.replay("session.s8e")
+
+The log is a marshal stream: a header dict (including the random seed)
+followed by one (frameCount, events) record for each frame that had events.
+Replay is deterministic provided the sketch does not depend on wall-clock
+time (e.g. realTime or simRate in a display window)."""
+
+import marshal, random
+import pygame
+from sc8pr import version
+
+_simple = int, float, str, bool, bytes, type(None)
+
+
+def _safe(v):
+    "Check whether a value can be saved with marshal"
+    t = type(v)
+    if t in _simple: return True
+    if t in (tuple, list): return all(_safe(x) for x in v)
+    return False
+
+
+class Recorder:
+    "Write events processed by Sketch._evHandle to a file"
+
+    def __init__(self, fn, seed=None, size=None):
+        if seed is None: seed = random.randrange(2 ** 32)
+        self.seed = seed
+        random.seed(seed)
+        self.frames = 0
+        self._file = open(fn, "wb")
+        marshal.dump({"sc8pr": tuple(version), "seed": seed, "size": size}, self._file)
+
+    def write(self, frame, events):
+        "Save the events for one frame"
+        if events and self._file:
+            ev = [(e.type, {k: v for k, v in e.dict.items() if _safe(v)}) for e in events]
+            marshal.dump((frame, ev), self._file)
+        self.frames = frame
+
+    def stop(self, sk=None):
+        "Called when the sketch exits; close the file"
+        f = self._file
+        if f:
+            marshal.dump((self.frames, None), f)
+            f.close()
+            self._file = None
+
+
+class Replay:
+    "Read a log created by Recorder and supply its events frame by frame"
+
+    def __init__(self, fn):
+        self._log = log = {}
+        with open(fn, "rb") as f:
+            self.header = marshal.load(f)
+            frames = 0
+            while True:
+                try: frame, ev = marshal.load(f)
+                except EOFError: break
+                if ev is None: frames = frame
+                else:
+                    log[frame] = ev
+                    frames = max(frames, frame)
+        self.frames = frames
+        self.seed = self.header["seed"]
+        random.seed(self.seed)
+
+    def events(self, frame):
+        "Return a list of the events recorded for the specified frame"
+        return [pygame.event.Event(*e) for e in self._log.get(frame, ())]
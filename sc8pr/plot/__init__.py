@@ -17,7 +17,7 @@
 
 "A collection of functions for plotting data on canvases"
 
-from sc8pr import Image, Graphic
+from sc8pr import Image, Graphic, SharedImage
 from sc8pr.text import Text
 from sc8pr.shape import Circle, Line, Polygon
 
@@ -44,7 +44,7 @@ def plot(cv, x, y=None, markers=5, offset=None, **kwargs):
         marker = lambda *i: Text(markers.format(x=i[0], y=i[1])).config(**kwargs)
     elif isinstance(markers, Graphic):
         markers = Image(markers)
-        marker = lambda *i: Image(markers).config(**kwargs)
+        marker = lambda *i: SharedImage(markers).config(**kwargs)
     else:
         marker = lambda *i: _marker(markers, *i).config(**kwargs)
     i = 0
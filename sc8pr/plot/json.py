@@ -69,5 +69,4 @@ def canvas(data):
 def save_png(json_fn, png_fn):
     "Convert JSON file data to PNG image"
     with open(png_fn, "wb") as f:
-        data = canvas(json_fn).snapshot().png
-        f.write(data.read())
+        f.write(canvas(json_fn).snapshot().png)
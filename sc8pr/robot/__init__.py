@@ -24,7 +24,7 @@ import pygame
 from pygame.constants import K_UP, K_DOWN, K_LEFT, K_RIGHT, K_SPACE
 from sc8pr import Image, Sketch
 from sc8pr.sprite import Sprite
-from sc8pr.util import logError, rgba, noise, divAlpha
+from sc8pr.util import logError, rgba, noise, divAlpha, iscoroutinefunction
 from sc8pr.geom import vec2d, delta, DEG, dist, angleDifference, subtend
 from sc8pr.shape import Line, Polygon
 
@@ -44,11 +44,15 @@ class RobotThread(Thread):
         if self.log:
             print('{} is running in thread {}.'.format(*args), file=stderr)
         try:
-            r._uptime = 0
-            while r._startup: r.sleep()
-            r.brain()
-            if hasattr(r, "shutdown"): r.shutdown()
-            r._uptime = None
+            if iscoroutinefunction(r.brain):
+                import asyncio
+                asyncio.run(r._brainAsync())
+            else:
+                r._uptime = 0
+                while r._startup: r.sleep()
+                r.brain()
+                if hasattr(r, "shutdown"): r.shutdown()
+                r._uptime = None
         except: logError()
         if self.log:
             print('{} is shutting down in thread {}.'.format(*args), file=stderr)
@@ -80,7 +84,7 @@ class Robot(Sprite):
     proximity = None
 
     def __init__(self, colors=None):
-        img = Image.fromZip("robot")
+        img = Image.fromZip("robot").copy()
         if colors:  # Replace body and nose colors
             px = pygame.PixelArray(img.image)
             body0, nose0, body, nose = rgba("red", "blue", *colors)
@@ -119,7 +123,20 @@ class Robot(Sprite):
         if b:
             self._startFrame = sk.frameCount
             self._gyro = self.angle
-            RobotThread(self).start()
+            if sk._async and iscoroutinefunction(self.brain):
+                import asyncio
+                asyncio.get_running_loop().create_task(self._brainAsync())
+            else: RobotThread(self).start()
+
+    async def _brainAsync(self):
+        "Run an 'async def' brain as a task in the sketch's event loop"
+        try:
+            self._uptime = 0
+            while self._startup: await self.sleepAsync()
+            await self.brain()
+            if hasattr(self, "shutdown"): self.shutdown()
+            self._uptime = None
+        except: logError()
 
     @property
     def active(self):
@@ -140,6 +157,19 @@ class Robot(Sprite):
         t = self.uptime + (t if t else dt)
         while self.uptime < t: sleep(dt)
 
+    async def sleepAsync(self, t=None):
+        "Coroutine version of sleep for 'async def' brains"
+        import asyncio
+        if not self.active: raise InactiveError()
+        dt = 1 / self.sketch.frameRate
+        t = self.uptime + (t if t else dt)
+        while self.uptime < t: await asyncio.sleep(dt)
+
+    async def updateSensorsAsync(self, wait=None):
+        self._updateSensors = True
+        await self.sleepAsync(wait)
+        return self
+
     @property
     def motors(self): return self._motors
 
@@ -178,7 +208,7 @@ class Robot(Sprite):
         # Update timer
         sk = self.sketch
         if self._uptime is not None:
-            self._uptime += 1 / sk.frameRate        
+            self._uptime += sk.stepTime
 
         # Target wheel speed...
         v = self.maxSpeed * sk.width
@@ -212,12 +242,15 @@ class Robot(Sprite):
 
         # Update sensors if requested...
         if self._updateSensors:
+            prof = sk.profiler
+            if prof: t = prof.time()
             try:
                 self._checkDown()
                 self._checkFront()
                 self._drawLEDs()
                 self._updateSensors = False
             except: logError()
+            if prof: prof.add("sensors", t)
         self._startup = False
 
     def sensorObjects(self, sk):
@@ -297,6 +330,7 @@ class Robot(Sprite):
                 pygame.draw.circle(orig, c if c else (0,0,0), pos, r)
                 pygame.draw.circle(orig, (0,0,0), pos, r, 1)
             srfs.dumpCache()
+        self._painted += 1
 
     @staticmethod
     def remoteControl(sk, ev):
@@ -17,11 +17,12 @@
 
 
 from random import random
+from collections import OrderedDict
 from math import hypot, ceil, sin, cos, pi, atan
 from sys import stderr
 import pygame
 from sc8pr import Graphic, Canvas, BaseSprite, CENTER, Image
-from sc8pr.util import rgba, hasAny, logError
+from sc8pr.util import rgba, hasAny, logError, CachedSurface
 from sc8pr.geom import transform_gen, transform2d, dist, delta, polar2d, circle_intersect, DEG, sigma, neg
 
 
@@ -136,7 +137,7 @@ class Circle(_Ellipse):
     def image(self):
         "Create a surface and draw the circle onto it"
         if self._srf: return self._srf
-        srf = pygame.Surface(self.size, pygame.SRCALPHA)
+        srf = CachedSurface.toDisplay(pygame.Surface(self.size, pygame.SRCALPHA))
         r = round(self.radius)
         pos = r, r
         wt = self.weight
@@ -275,6 +276,10 @@ class Line(Shape):
         r = pygame.draw.line(srf, self._stroke, (x1+dx,y1+dy), (x2+dx,y2+dy), wt)
         return r.inflate(wt, wt)
 
+    def _drawKey(self):
+        "Clipped thick lines rasterize differently, so always redraw the full frame"
+        return None
+
     def containsPoint(self, xy):
         "Check if a point is exactly on the line"
         return dist(self.closest(xy), xy) == 0
@@ -297,6 +302,9 @@ class Line(Shape):
 class Polygon(Shape):
     _angle = 0
     _preserve = "anchor", "vertices"
+    _srf = _segCache = _rotBase = _rotAngle = _rotSrf = _vertAngle = None
+    angleStep = 0   # Round angles to a multiple of this step when > 0
+    rotCache = 0    # Rotated surfaces to keep per instance when angleStep > 0
 
     def setPoints(self, pts, anchor=None):
         self.vertices = pts
@@ -311,6 +319,7 @@ class Polygon(Shape):
     @vertices.setter
     def vertices(self, pts):
         self._dumpCache()
+        self._vertAngle = None
         self._vertices = v = []
         p0 = None
         for p in pts:
@@ -338,12 +347,14 @@ class Polygon(Shape):
         # Metrics in pixel coordinates
         self._px_vert = pts = cv.px_list(*v)
         (x0, x1), (y0, y1) = self._findRect(pts)
+        self._pxMin = x0, y0
         w, h = abs(x1 - x0), abs(y1 - y0)
         wt = self.weight
         pos = round(x0) - wt, round(y0) - wt
         wt *= 2
         size = ceil(w) + wt, ceil(h) + wt
         self._rect = pygame.Rect(pos, size)
+        if self._srf and self._srf.get_size() != size: self._srf = None
 
     def setCanvas(self, cv, key=None):
         super()._setCanvas(cv, key)
@@ -357,6 +368,20 @@ class Polygon(Shape):
     def _dumpCache(self):
         self._srf = None
         self._segCache = None
+        self._dumpRotations()
+
+    def _dumpRotations(self):
+        "Discard the rotation cache"
+        if self._rotSrf: CachedSurface.lru.purge(self._rotSrf)
+        self._rotBase = self._rotAngle = None
+
+    def _rotSurfaces(self):
+        "Return the rotated surface cache, registering it with the shared LRU list"
+        d = self._rotSrf
+        if d is None:
+            d = self._rotSrf = {}
+            CachedSurface.lru.track(self, d)
+        return d
 
     @property
     def image(self):
@@ -366,9 +391,11 @@ class Polygon(Shape):
             offset = self._rect.topleft
             rnd = lambda x: (round(x[0]), round(x[1]))
             pts = [rnd(delta(p, offset)) for p in self._px_vert]
-            self._srf = srf = pygame.Surface(self._rect.size, pygame.SRCALPHA)
+            self._srf = srf = CachedSurface.toDisplay(pygame.Surface(self._rect.size, pygame.SRCALPHA))
             if f: pygame.draw.polygon(srf, f, pts)
             if wt and s: pygame.draw.polygon(srf, s, pts, wt)
+            a = self._rotAngle
+            if a is not None: CachedSurface.lru.store(self._rotSurfaces(), a, srf)
         return self._srf
 
     @property
@@ -379,16 +406,34 @@ class Polygon(Shape):
         if type(a) is int: self._anchor = self._vertices[a]
         elif a: self._anchor = a
         else: self._anchor = self._csrect["center"]
+        self._dumpRotations()
 
     @property
     def xy(self): return self._anchor
 
     @xy.setter
     def xy(self, xy):
+        "Translate the polygon, keeping the rendered surface and segments"
         d = delta(xy, self._anchor)
-        pts = (sigma(v, d) for v in self._vertices)
-        self.setPoints(pts)
         self._anchor = xy
+        if d == (0, 0): return
+        dx, dy = d
+        self._vertices = [(x + dx, y + dy) for x, y in self._vertices]
+        segs = self._segCache
+        if segs:
+            for s in segs: s._start = sigma(s._start, d)
+        cs = self._csrect
+        cs["topleft"] = sigma(cs["topleft"], d)
+        cs["center"] = sigma(cs["center"], d)
+
+        # Shift pixel metrics; px is an affine transformation
+        cv = self.canvas
+        dx, dy = delta(cv.px(dx, dy), cv.px(0, 0))
+        self._px_vert = [(x + dx, y + dy) for x, y in self._px_vert]
+        x0, y0 = self._pxMin
+        self._pxMin = x0, y0 = x0 + dx, y0 + dy
+        wt = self.weight
+        self._rect = pygame.Rect((round(x0) - wt, round(y0) - wt), self._rect.size)
 
     @property
     def pos(self):
@@ -413,8 +458,39 @@ class Polygon(Shape):
 
     @angle.setter
     def angle(self, a):
-        self.transform((a - self._angle) if self.clockwise else (self._angle - a))
+        """Rotate around the anchor, starting from an unrotated copy of the vertices;
+        with angleStep and rotCache, reuse cached vertices and surfaces"""
+        if a == self._angle: return
+        a0 = self._vertAngle
+        if a0 is None: a0 = self._angle
         self._angle = a
+        step = self.angleStep
+        if step: a = round(a / step) * step % 360
+        if a == a0: return
+        base = self._rotBase
+        if base is None:
+            xy = self._anchor
+            base = self._rotBase = a0, [delta(v, xy) for v in self._vertices], OrderedDict()
+        a0, rel, cache = base
+        n = self.rotCache if step else 0
+        verts = cache.get(a) if n else None
+        srf = None
+        if verts is None:
+            r = (a - a0) if self.clockwise else (a0 - a)
+            verts = list(transform_gen(rel, None, 1, r))
+            if n:
+                cache[a] = verts
+                if len(cache) > n: CachedSurface.lru.discard(self._rotSurfaces(), cache.popitem(False)[0])
+        else:
+            cache.move_to_end(a)
+            srf = self._rotSurfaces().get(a)
+            if srf is not None: CachedSurface.lru.touch(self._rotSrf, a)
+        x, y = self._anchor
+        self._vertices = [(x + v[0], y + v[1]) for v in verts]
+        self._srf, self._segCache = srf, None
+        self._rotAngle = a if n else None
+        self._vertAngle = a
+        self._metrics()
 
     def _segments(self):
         "Generate the line segments of the polygon"
@@ -611,7 +687,7 @@ class Ellipse(_Ellipse):
     @property
     def image(self):
         if self._srf: return self._srf
-        srf = pygame.Surface(self.size, pygame.SRCALPHA)
+        srf = CachedSurface.toDisplay(pygame.Surface(self.size, pygame.SRCALPHA))
         r = pygame.Rect((0, 0), self.size)
         self._render(srf, r)
         if self.angle:
@@ -17,13 +17,47 @@
 
 
 from math import hypot
+from threading import Thread
+from weakref import WeakValueDictionary
+import pygame
 from pygame.sprite import collide_mask, collide_rect, collide_circle
 from sc8pr import BaseSprite, Image, Graphic
-from sc8pr.util import customEv
+from sc8pr.util import customEv, scale
+from sc8pr._grid import RectGrid
+
+try:
+    import numpy as np
+except:
+    np = None
+
+
+class _Atlas:
+    "Pre-rendered rotations and masks for a list of costume surfaces"
+    frames = None
+
+    def __init__(self, srfs, size, steps):
+        self.srfs = srfs
+        self.size = size
+        self.steps = steps
+
+    def render(self):
+        size, n = self.size, self.steps
+        frames = []
+        for srf in self.srfs:
+            if srf.get_size() != size: srf = scale(srf, size)
+            rot = []
+            for i in range(n):
+                r = pygame.transform.rotate(srf, -360 * i / n) if i else srf
+                rot.append((r, pygame.mask.from_surface(r)))
+            frames.append(rot)
+        self.frames = frames
+        self.srfs = None
 
 
 class CostumeImage(Graphic):
     _seq = None
+    _atlas = None
+    _atlases = WeakValueDictionary()
     cycle = True
     _costumeNumber = costumeTime = 0
 
@@ -57,6 +91,33 @@ class CostumeImage(Graphic):
         "Return an Image instance of the current costume"
         return self._costumeList[self._index()].config(size=self.size, angle=self.angle)
 
+    def prerender(self, steps=72, thread=False):
+        "Pre-render rotations and masks of all costumes at the current size; call again after resizing"
+        if not steps:
+            self._atlas = None
+            return self
+        w, h = self.size
+        size = max(1, round(w)), max(1, round(h))
+        srfs = tuple(img._srf.original for img in self._costumeList)
+        key = srfs, size, steps
+        a = CostumeImage._atlases.get(key)
+        if a is None:
+            a = _Atlas(srfs, size, steps)
+            CostumeImage._atlases[key] = a
+            if thread: Thread(target=a.render, daemon=True).start()
+            else: a.render()
+        self._atlas = a
+        return self
+
+    def _atlasFrame(self):
+        "Return the pre-rendered (surface, mask) nearest the current angle, or None"
+        a = self._atlas
+        if a is None or a.frames is None: return None
+        w, h = self.size
+        if a.size != (max(1, round(w)), max(1, round(h))): return None
+        n = a.steps
+        return a.frames[self._index()][round(self.angle * n / 360) % n]
+
     @property
     def costumeList(self): return self._costumeList
 
@@ -75,7 +136,12 @@ class CostumeImage(Graphic):
     @property
     def image(self):
         "Return the current costume as a scaled and rotated surface"
-        return self.costume().image
+        f = self._atlasFrame()
+        return self.costume().image if f is None else f[0]
+
+    def _autoMask(self):
+        f = self._atlasFrame()
+        return self.costume()._autoMask() if f is None else f[1]
 
     def contains(self, pos):
         "Determine if sprite contains the specified point"
@@ -127,7 +193,14 @@ def collide_rect_circ(left, right):
     return 1 if collide_rect(left, right) and collide_circle(left, right) else 0
 
 
+# Collision functions that can only succeed when the rects overlap
+_rectCollide = collide_rect, collide_mask, collide_rect_circ, collide_rect_mask
+
+
 class Collisions:
+    broadPhase = None   # None: use broad phase for rect-based collide functions
+    gridSize = 64
+    _broad = None
 
     def __init__(self, cv, collide=collide_rect_circ):
         self.cv = cv
@@ -138,25 +211,50 @@ class Collisions:
         if convert and type(g) not in (tuple, list, set): g = list(g)
         return g
 
+    def _grid(self, group):
+        "Return a grid of the group's rects for broad-phase tests, reused within a frame of a running sketch"
+        b = self.broadPhase
+        if b is None: b = self.collide in _rectCollide
+        if not b: return None
+        sk = self.cv.sketch
+        key = (sk.frameCount, tuple(group)) if sk else None
+        if key and self._broad and self._broad[0] == key: return self._broad[1]
+        grid = RectGrid(self.gridSize)
+        for s in group:
+            r = getattr(s, "rect", None)
+            if r is not None: grid.add(s, r)
+        self._broad = key, grid
+        return grid
+
+    def _involving(self, sprite, group, asBool=False):
+        coll = {}
+        for s in group:
+            if s is not sprite:
+                c = hasattr(s, "rect") and self.collide(sprite, s)
+                if c:
+                    if asBool: return True
+                    coll[s] = c
+        return False if asBool else coll
+
     def involving(self, sprite, group=None, asBool=False):
         "Detect whether a sprite is colliding with any of the specified sprites"
-        coll = {}
         if hasattr(sprite, "rect"):
-            for s in self._group(group):
-                if s is not sprite:
-                    c = hasattr(s, "rect") and self.collide(sprite, s)
-                    if c:
-                        if asBool: return True
-                        coll[s] = c
-        return False if asBool else coll
+            group = self._group(group, True)
+            grid = self._grid(group)
+            if grid is not None: group = grid.near(sprite.rect)
+            return self._involving(sprite, group, asBool)
+        return False if asBool else {}
 
     def betweenMap(self, group1, group2=None):
         "Detect collisions between two groups and return a map"
         group2 = self._group(group2, True)
+        grid = self._grid(group2)
         collMap = {}
         for s in self._group(group1):
-            for k, v in self.involving(s, group2).items():
-                collMap[(s,k)] = v
+            if hasattr(s, "rect"):
+                g = group2 if grid is None else grid.near(s.rect)
+                for k, v in self._involving(s, g).items():
+                    collMap[(s,k)] = v
         return collMap
 
     def between(self, group1, group2=None):
@@ -168,10 +266,15 @@ class Collisions:
         "Return a map of collisions within a group of sprites"
         collMap = {}
         group = self._group(group, True)
+        grid = self._grid(group)
+        if grid is not None: index = {s: i for i, s in enumerate(group)}
         n = len(group)
         for i in range(n):
             s = group[i]
-            c = self.involving(s, group[i+1:])
+            if grid is None: c = self.involving(s, group[i+1:])
+            elif hasattr(s, "rect"):
+                c = self._involving(s, [t for t in grid.near(s.rect) if index[t] > i])
+            else: c = None
             if c:
                 if s not in collMap: collMap[s] = {}
                 m = collMap[s]
@@ -213,17 +316,80 @@ def elasticCircles(mass1, mass2):
         mass2.vel = (p2x + impulse * nx) / m2, (p2y + impulse * ny) / m2
         return True
 
-def physics(cv, model=elasticCircles):
-    "Update colliding masses on a pair-wise basis; call oncollide handlers"
+def _contacts(pos, rad):
+    "Use a spatial hash to find pairs (i < j) of overlapping circles"
+    n = len(pos)
+    cell = 2 * rad.max()
+    if not cell > 0: return np.zeros(0, int), np.zeros(0, int)
+    ij = np.floor(pos / cell).astype(np.int64)
+    ij -= ij.min(axis=0) - 1
+    k = ij[:, 1].max() + 2
+    key = ij[:, 0] * k + ij[:, 1]
+    order = np.argsort(key, kind="stable")
+    skey = key[order]
+    first, second = [], []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            q = key + (dx * k + dy)
+            lo = np.searchsorted(skey, q, "left")
+            cnt = np.searchsorted(skey, q, "right") - lo
+            total = cnt.sum()
+            if not total: continue
+            i = np.repeat(np.arange(n), cnt)
+            start = np.repeat(lo - np.cumsum(cnt) + cnt, cnt)
+            j = order[start + np.arange(total)]
+            keep = i < j
+            first.append(i[keep])
+            second.append(j[keep])
+    i, j = np.concatenate(first), np.concatenate(second)
+    d = pos[j] - pos[i]
+    r = np.hypot(d[:, 0], d[:, 1])
+    keep = (r < rad[i] + rad[j]) & (r > 0)
+    return i[keep], j[keep]
+
+def _elasticArrays(masses):
+    "Vectorized elasticCircles for all pairs; return the indices of colliding masses"
+    pos = np.array([m.rect.center for m in masses], float)
+    vel = np.array([m.vel for m in masses], float)
+    rad = np.array([m.radius for m in masses], float)
+    mass = np.array([m.mass for m in masses], float)
+    i, j = _contacts(pos, rad)
+
+    # Impulses are calculated from the initial velocities of all pairs
+    d = pos[j] - pos[i]
+    nrm = d / np.hypot(d[:, 0], d[:, 1])[:, None]
+    m1, m2 = mass[i], mass[j]
+    p1 = (m1[:, None] * vel[i] * nrm).sum(axis=1)
+    p2 = (m2[:, None] * vel[j] * nrm).sum(axis=1)
+    impulse = 2 * (m2 * p1 - m1 * p2) / (m1 + m2)
+    hit = impulse > 0
+    i, j, nrm, impulse = i[hit], j[hit], nrm[hit], impulse[hit]
+    dv = impulse[:, None] * nrm
+    np.add.at(vel, i, -dv / mass[i][:, None])
+    np.add.at(vel, j, dv / mass[j][:, None])
+    coll = np.unique(np.concatenate((i, j)))
+    for c in coll.tolist(): masses[c].vel = tuple(vel[c].tolist())
+    return coll.tolist()
+
+vectorMin = 64
+
+def physics(cv, model=elasticCircles, vectorize=None):
+    """Update colliding masses on a pair-wise basis; call oncollide handlers;
+    large groups of elasticCircles are handled by numpy when available"""
     masses = [m for m in cv if isinstance(m, BaseSprite) and hasattr(m, "mass")]
-    coll = []
     n = len(masses)
-    for m1 in range(n-1):
-        m = masses[m1]
-        for m2 in range(m1 + 1, n):
-            args = m, masses[m2]
-            if model(*args): coll.extend(args)
-    coll = list(m for m in masses if m in coll)
+    if vectorize is None:
+        vectorize = np is not None and model is elasticCircles and n >= vectorMin
+    if vectorize:
+        coll = [masses[i] for i in _elasticArrays(masses)] if n > 1 else []
+    else:
+        coll = []
+        for m1 in range(n-1):
+            m = masses[m1]
+            for m2 in range(m1 + 1, n):
+                args = m, masses[m2]
+                if model(*args): coll.extend(args)
+        coll = list(m for m in masses if m in coll)
     for m in coll:
         if hasattr(m, "oncollide"): m.oncollide()
     return coll
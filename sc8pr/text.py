@@ -69,6 +69,7 @@ class Font:
 
     @staticmethod
     def _get(name, size, style):
+        if not pf.get_init(): pf.init()
         if name and "." in name:
             font = pf.Font(name, size)
         else:
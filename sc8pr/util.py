@@ -16,9 +16,11 @@
 # along with "sc8pr".  If not, see <http://www.gnu.org/licenses/>.
 
 
-import io, sys, pygame
+import io, sys, weakref, pygame
 from random import randint
-from traceback import format_exc
+from collections import OrderedDict
+from traceback import format_exc, format_exception
+from inspect import iscoroutinefunction
 from zipfile import ZipFile
 from pathlib import Path
 from sc8pr.geom import sigma, delta
@@ -36,6 +38,28 @@ def makeDict(*args, **kwargs):
 def customEv(**kwargs):
     return pygame.event.Event(pygame.USEREVENT, **kwargs)
 
+def asyncHandler(f):
+    """Wrap a coroutine function so that calling it schedules a task in the
+    running asyncio loop (or runs it to completion if there is none); calls
+    for an instance whose previous task is still pending are ignored"""
+    tasks = {}
+    def done(key, t):
+        tasks.pop(key, None)
+        if not t.cancelled() and t.exception():
+            err = t.exception()
+            print("".join(format_exception(type(err), err, err.__traceback__)), file=sys.stderr)
+    def handler(obj, *args):
+        import asyncio
+        key = id(obj)
+        if key in tasks: return
+        coro = f(obj, *args)
+        try: loop = asyncio.get_running_loop()
+        except RuntimeError: return asyncio.run(coro)
+        t = tasks[key] = loop.create_task(coro)
+        t.add_done_callback(lambda t: done(key, t))
+    handler.__name__ = f.__name__
+    return handler
+
 def modKeys():
     key = pygame.key.get_pressed()
     m = 0
@@ -123,8 +147,7 @@ def setAlpha(srf, a):
     srf.fill((255,255,255,a), special_flags=pygame.BLEND_RGBA_MIN)
     return srf
 
-_srf_rgba = pygame.Surface((2, 2), pygame.SRCALPHA, 32)
-_srf_rgb = pygame.Surface((2, 2), depth=24)
+_srf_fmt = {}
 _srf_val_err = ValueError("object cannot be converted to a Surface")
 
 def surface(srf, alpha=None):
@@ -139,8 +162,16 @@ def surface(srf, alpha=None):
             try: srf = Image.frombytes(srf, False)
             except: raise _srf_val_err
     a = hasAlpha(srf), srf.get_bitsize()
-    if alpha is True and a != (True, 32): srf = srf.convert_alpha(_srf_rgba)
-    elif alpha is False and a != (False, 24): srf = srf.convert(_srf_rgb)
+    if alpha is True and a != (True, 32): srf = srf.convert_alpha(_srfFormat(True))
+    elif alpha is False and a != (False, 24): srf = srf.convert(_srfFormat(False))
+    return srf
+
+def _srfFormat(alpha):
+    "Reference surface for RGBA or RGB conversion, created on first use"
+    srf = _srf_fmt.get(alpha)
+    if srf is None:
+        srf = pygame.Surface((2, 2), pygame.SRCALPHA, 32) if alpha else pygame.Surface((2, 2), depth=24)
+        _srf_fmt[alpha] = srf
     return srf
 
 def style(srf, bg=None, border=(0,0,0), weight=0, padding=0, borderradius=None):
@@ -190,6 +221,48 @@ def drawBorder(srf, color=(0,0,0), weight=1, r=None):
     for s in sides:
         if s: srf.subsurface(s).fill(color)
 
+def _area(r): return r.width * r.height
+
+def mergeRects(rects, bounds, gap=8, maxRects=32, rectCost=1024):
+    """Clip rects to bounds and merge those that overlap or are within 'gap' pixels,
+    when this costs less than 'rectCost' extra pixels; return None if updating
+    the entire bounds is expected to be cheaper"""
+    full = _area(bounds)
+    rects = [r.clip(bounds) for r in rects]
+    rects = [r for r in rects if r.width and r.height]
+
+    # Skip merging when the rects are too costly even before merging
+    cost = 0
+    for r in rects: cost += _area(r) + rectCost
+    if cost >= full:
+        if not rects: return []
+        u = rects[0].unionall(rects)
+        return [u] if _area(u) + rectCost < full else None
+
+    merged = []
+    for r in rects:
+        grow = True
+        while grow:
+            grow = False
+            for j in reversed(r.inflate(2 * gap, 2 * gap).collidelistall(merged)):
+                m = merged[j]
+                u = r.union(m)
+                if _area(u) - _area(r) - _area(m) + _area(r.clip(m)) <= rectCost:
+                    del merged[j]
+                    r = u
+                    grow = True
+        merged.append(r)
+
+    # Limit number of rects
+    while len(merged) > maxRects:
+        merged.sort(key=lambda r: (r.y, r.x))
+        merged = [merged[i].unionall(merged[i+1:i+2]) for i in range(0, len(merged), 2)]
+
+    # Compare cost of partial update with full update
+    cost = 0
+    for r in merged: cost += _area(r) + rectCost
+    return None if cost >= full else merged
+
 def tile(srf, tile=0, cols=1, rows=1, padding=0):
     "Return a tile subsurface"
     w, h = srf.get_size()
@@ -279,46 +352,297 @@ def crop(srf, bg=True):
     return srf
 
 
+def _srfBytes(srf): return srf.get_pitch() * srf.get_height()
+
+
+class SurfaceLRU:
+    """A least recently used list of surfaces held in the cache dictionaries
+    of many owners, with a shared memory limit"""
+
+    def __init__(self, limit):
+        self._items = OrderedDict()
+        self._limit = limit
+        self.memory = 0
+
+    def __len__(self): return len(self._items)
+
+    @property
+    def limit(self): return self._limit
+
+    @limit.setter
+    def limit(self, n):
+        self._limit = n
+        self.trim()
+
+    def track(self, owner, cache):
+        "Remove the cache's surfaces from the list when the owner is collected"
+        weakref.finalize(owner, self.purge, cache)
+
+    def store(self, cache, key, srf):
+        "Add a surface to a cache dictionary and evict surfaces over the memory limit"
+        self.discard(cache, key)
+        cache[key] = srf
+        size = _srfBytes(srf)
+        self._items[id(cache), key] = cache, size
+        self.memory += size
+        self.trim(1)
+
+    def touch(self, cache, key):
+        "Mark a surface as recently used"
+        self._items.move_to_end((id(cache), key))
+
+    def discard(self, cache, key):
+        "Remove a surface from a cache dictionary and the list"
+        item = self._items.pop((id(cache), key), None)
+        if item: self.memory -= item[1]
+        cache.pop(key, None)
+
+    def purge(self, cache):
+        "Remove all surfaces in a cache dictionary"
+        for key in list(cache): self.discard(cache, key)
+
+    def trim(self, keep=0):
+        "Evict least recently used surfaces until memory is within the limit"
+        items = self._items
+        while self.memory > self._limit and len(items) > keep:
+            (i, key), (cache, size) = items.popitem(False)
+            cache.pop(key, None)
+            self.memory -= size
+
+
+class AssetCache:
+    """Process-wide cache of decoded image assets and the scaled variants
+    of those assets; other surfaces are scaled without caching"""
+    enabled = True
+    memoryLimit = 128 * 1024 * 1024
+    maxVariants = 4     # Scaled variants to keep for each asset
+    _assets = OrderedDict()
+    _scaled = OrderedDict()
+    _keys = {}
+    _variants = {}
+    _users = {}
+    _memory = 0
+    _trimAt = 0
+
+    @staticmethod
+    def load(key, loader):
+        "Return the surface cached under key, calling loader to decode it on a miss"
+        if not AssetCache.enabled: return loader()
+        assets = AssetCache._assets
+        srf = assets.get(key)
+        if srf is None:
+            srf = loader()
+            AssetCache._keys[srf] = key
+            AssetCache._variants[srf] = {}
+            AssetCache._users[srf] = 0
+            AssetCache._add(assets, key, srf)
+        else: assets.move_to_end(key)
+        return srf
+
+    @staticmethod
+    def file(fn):
+        "Load an image file, decoding each file only once"
+        p = Path(fn).resolve()
+        return AssetCache.load(("file", str(p), p.stat().st_mtime), lambda: pygame.image.load(fn))
+
+    @staticmethod
+    def isAsset(srf): return srf in AssetCache._keys
+
+    @staticmethod
+    def use(owner, srf):
+        "Prevent an asset from being evicted until the owner is collected"
+        AssetCache._users[srf] += 1
+        weakref.finalize(owner, AssetCache._release, srf)
+
+    @staticmethod
+    def _release(srf):
+        n = AssetCache._users.get(srf)
+        if n: AssetCache._users[srf] = n - 1
+
+    @staticmethod
+    def scaled(srf, size):
+        "Return a scaled copy of the surface, shared with other users if the surface is an asset"
+        v = AssetCache._variants.get(srf) if AssetCache.enabled else None
+        if v is None: return CachedSurface.toDisplay(scale(srf, size))
+        key = srf, size
+        cache = AssetCache._scaled
+        s = cache.get(key)
+        if s is None:
+            if len(v) >= AssetCache.maxVariants:
+                AssetCache._memory -= _srfBytes(cache.pop((srf, next(iter(v)))))
+                del v[next(iter(v))]
+            s = CachedSurface.toDisplay(scale(srf, size))
+            AssetCache._add(cache, key, s)
+            v[size] = True
+        else: cache.move_to_end(key)
+        return s
+
+    @staticmethod
+    def display(srf, alpha=None):
+        "Convert an asset to the display format (or using util.surface if no display exists), sharing the result"
+        if CachedSurface._display() is None: return surface(srf, alpha)
+        key = AssetCache._keys.get(srf)
+        if key is None: return CachedSurface.toDisplay(srf, alpha)
+        return AssetCache.load(("display", key, alpha), lambda: CachedSurface.toDisplay(srf, alpha))
+
+    @staticmethod
+    def discard(srf):
+        "Remove all scaled variants of a surface"
+        v = AssetCache._variants.get(srf)
+        if v:
+            cache = AssetCache._scaled
+            for size in v: AssetCache._memory -= _srfBytes(cache.pop((srf, size)))
+            v.clear()
+
+    @staticmethod
+    def _add(cache, key, srf):
+        cache[key] = srf
+        AssetCache._memory += _srfBytes(srf)
+        if AssetCache._memory > max(AssetCache.memoryLimit, AssetCache._trimAt): AssetCache.trim()
+
+    @staticmethod
+    def trim(limit=None):
+        "Evict least recently used scaled variants, and assets that are not in use"
+        if limit is None: limit = AssetCache.memoryLimit
+        excess = AssetCache._memory - limit
+        users = AssetCache._users
+        for cache in (AssetCache._scaled, AssetCache._assets):
+            evict = []
+            for key in cache:
+                if excess <= 0: break
+                srf = cache[key]
+                if cache is AssetCache._scaled or not users[srf]:
+                    evict.append(key)
+                    excess -= _srfBytes(srf)
+            for key in evict:
+                srf = cache.pop(key)
+                AssetCache._memory -= _srfBytes(srf)
+                if cache is AssetCache._scaled: del AssetCache._variants[key[0]][key[1]]
+                else:
+                    AssetCache.discard(srf)
+                    for d in (AssetCache._keys, AssetCache._variants, users): del d[srf]
+
+        # Assets still in use: don't search again until memory grows further
+        m = AssetCache._memory
+        AssetCache._trimAt = m + limit // 8 if m > limit else 0
+
+
 class CachedSurface:
     "A class for caching scaled and rotated surfaces"
+    cacheSize = 0   # Additional scaled/rotated surfaces to keep per instance
+    angleStep = 0   # Round angles to a multiple of this step when > 0
+    displayFormat = True    # Convert surfaces created by sc8pr to the display format
+    lru = SurfaceLRU(64 * 1024 * 1024)   # Shared by all instances
+    _owned = _asset = None
+    _tracked = False
 
     def __init__(self, srf, bg=None):
         if hasattr(srf, "image"): srf = srf.image
         t = type(srf)
         if t is str:
-            srf = pygame.image.load(srf)
-            if bg: srf = style(srf, bg)
+            srf = AssetCache.file(srf)
+            if bg: srf = self.toDisplay(style(srf, bg))
 # !!!            elif srf.get_bitsize() < 32: srf = srf.convert_alpha()
-            else: srf = surface(srf, True)
+            else: srf = AssetCache.display(srf, True)
         elif t in (list, tuple):
-            srf = pygame.Surface(srf, pygame.SRCALPHA)
+            srf = self.toDisplay(pygame.Surface(srf, pygame.SRCALPHA))
             if bg is not None:
                 srf.fill(bg if type(bg) is pygame.Color else rgba(bg))
-        self.original = srf if type(srf) is pygame.Surface else surface(srf)
-        self.dumpCache()
+        if AssetCache.isAsset(srf):   # Keep a private copy; share only scaled variants
+            AssetCache.use(self, srf)
+            self._asset = srf
+            srf = srf.copy()
+        self.original = srf = srf if type(srf) is pygame.Surface else surface(srf)
+        if self.displayFormat:
+            ck = srf.get_colorkey()
+            if ck and not srf.get_flags() & pygame.RLEACCEL:
+                srf.set_colorkey(ck, pygame.RLEACCEL)
+        self._cache = OrderedDict()
+        self._reset()
+
+    @staticmethod
+    def _display():
+        "Return the display surface if surfaces should be converted to its format"
+        d = pygame.display.get_surface() if CachedSurface.displayFormat else None
+        return d if d is not None and d.get_bitsize() >= 24 else None
+
+    @staticmethod
+    def toDisplay(srf, alpha=None):
+        "Convert a surface to the pixel format of the display, if one exists"
+        if CachedSurface._display() is None: return srf
+        if alpha is None: alpha = hasAlpha(srf)
+        ck = srf.get_colorkey()
+        srf = srf.convert_alpha() if alpha else srf.convert()
+        if ck and not alpha: srf.set_colorkey(ck, pygame.RLEACCEL)
+        return srf
 
     def dumpCache(self):
-        "Remove scaled and rotated images from cache"
+        "Remove scaled and rotated images from cache and stop using shared variants"
+        self._asset = None
+        self._reset()
+
+    def _reset(self):
+        self._masks = {}
         srf = self.original
         self.scaled = srf.get_size(), srf
         self.rotated = 0, srf
+        CachedSurface.lru.purge(self._cache)
+
+    def _cached(self, key):
+        "Look up a surface in the LRU cache"
+        srf = self._cache.get(key)
+        if srf is not None:
+            self._cache.move_to_end(key)
+            CachedSurface.lru.touch(self._cache, key)
+        return srf
+
+    def _store(self, key, srf):
+        "Add a surface to the LRU cache, evicting the least recently used surfaces"
+        n = self.cacheSize
+        if not n: return
+        cache = self._cache
+        lru = CachedSurface.lru
+        if not self._tracked:
+            lru.track(self, cache)
+            self._tracked = True
+        lru.store(cache, key, srf)
+        if len(cache) > n: lru.discard(cache, next(iter(cache)))
 
     def get_surface(self, size=None, angle=0):
         "Obtain a scaled and rotated image, updating the cache"
         if size is None: size = self.original.get_size()
         else: size = max(1, round(size[0])), max(1, round(size[1]))
+        step = self.angleStep
+        if angle and step: angle = round(angle / step) * step % 360
         sz, srf = self.scaled
         if sz != size: # smoothscale crashes sometimes for 1x1 surface!!
-            srf = scale(self.original, size)
+            srf = self._cached((size, 0))
+            if srf is None:
+                a = self._asset
+                srf = AssetCache.scaled(self.original if a is None else a, size)
+                self._store((size, 0), srf)
             self.scaled = size, srf
             self.rotated = 0, srf
         if angle:
             a, srf = self.rotated
             if a != angle:
-                srf = pygame.transform.rotate(self.scaled[1], -angle)
+                srf = self._cached((size, angle))
+                if srf is None:
+                    srf = pygame.transform.rotate(self.scaled[1], -angle)
+                    self._store((size, angle), srf)
                 self.rotated = angle, srf
         return srf
 
+    def get_mask(self, size=None, angle=0):
+        "Obtain the mask of a scaled and rotated image, cached with the surface"
+        srf = self.get_surface(size, angle)
+        masks = self._masks
+        m = masks.get(srf)
+        if m is None:
+            m = masks[srf] = pygame.mask.from_surface(srf)
+            if len(masks) > self.cacheSize + 2: del masks[next(iter(masks))]
+        return m
+
     def get_size(self, n=0):
         srf = getattr(self, ("scaled", "rotated")[n-1])[1] if n else self.original
         return srf.get_size()
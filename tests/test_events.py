@@ -0,0 +1,53 @@
+# Copyright 2015-2023 D.G. MacCarthy <https://dmaccarthy.github.io/sc8pr>
+#
+# This file is part of "sc8pr".
+#
+# "sc8pr" is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# "sc8pr" is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with "sc8pr".  If not, see <http://www.gnu.org/licenses/>.
+
+"Event coalescing and hover tracking"
+
+import pygame
+from sc8pr import Sketch, Image
+from sc8pr._event import coalesce
+
+
+def motion(pos, rel=(1, 0), buttons=(0, 0, 0)):
+    return pygame.event.Event(pygame.MOUSEMOTION, pos=pos, rel=rel, buttons=buttons)
+
+
+def test_coalesce_merges_motion():
+    ev = coalesce([motion((1, 1)), motion((2, 1)), motion((3, 1), buttons=(1, 0, 0))])
+    assert len(ev) == 2
+    assert ev[0].pos == (2, 1) and ev[0].rel == (2, 0)
+
+
+def test_coalesce_drops_repeated_keydown():
+    down = lambda: pygame.event.Event(pygame.KEYDOWN, key=pygame.K_a)
+    up = pygame.event.Event(pygame.KEYUP, key=pygame.K_a)
+    assert len(coalesce([down(), down(), up, down()])) == 3
+
+
+def test_hover_follows_moved_target():
+    sk = Sketch((200, 200)).config(headless=True, coalesce=True)
+    sk._start(None, None, 0)
+    img = Image((20, 20), "red").config(pos=(50, 50))
+    sk += img
+    sk._render()
+    sk.evMgr.dispatch(motion((50, 50)))
+    assert sk.evMgr.hover is img
+    img.config(pos=(150, 150))
+    img.rect = img.draw(sk.image)
+    sk.evMgr.dispatch(motion((50, 50)))
+    assert sk.evMgr.hover is sk
+    sk._stop()
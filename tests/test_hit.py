@@ -0,0 +1,49 @@
+# Copyright 2015-2023 D.G. MacCarthy <https://dmaccarthy.github.io/sc8pr>
+#
+# This file is part of "sc8pr".
+#
+# "sc8pr" is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# "sc8pr" is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with "sc8pr".  If not, see <http://www.gnu.org/licenses/>.
+
+"Hit-testing with the spatial grid must agree with a linear search"
+
+from random import seed, uniform
+from sc8pr import Sketch, Image, BOTH
+from sc8pr.sprite import Sprite
+
+
+def hits(gridSize, retained=False, n=100, frames=20):
+    "Return objectAt results for a fixed set of points after each of several frames"
+    seed(2)
+    sk = Sketch((300, 200)).config(headless=True, retained=retained, gridSize=gridSize)
+    sk._start(None, None, 0)
+    img = Image((16, 16), "red")
+    for i in range(n):
+        sk += Sprite(img).config(pos=(uniform(0, 300), uniform(0, 200)),
+            vel=(uniform(-3, 3), uniform(-3, 3)), bounce=BOTH)
+    items = list(sk)
+    pts = [(uniform(0, 300), uniform(0, 200)) for i in range(50)]
+    data = []
+    for f in range(frames):
+        sk._frame()
+        data.append([items.index(g) if g in items else -1 for g in map(sk.objectAt, pts)])
+    sk._stop()
+    return data
+
+
+def test_grid_matches_linear_search():
+    assert hits(64) == hits(0)
+
+
+def test_grid_matches_linear_search_retained():
+    assert hits(64, True) == hits(0)
@@ -0,0 +1,78 @@
+# Copyright 2015-2023 D.G. MacCarthy <https://dmaccarthy.github.io/sc8pr>
+#
+# This file is part of "sc8pr".
+#
+# "sc8pr" is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# "sc8pr" is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with "sc8pr".  If not, see <http://www.gnu.org/licenses/>.
+
+"Creating Images from other sources, and sharing cached assets between Images"
+
+import gc
+import pytest
+from sc8pr import Canvas, Image
+from sc8pr.shape import Circle
+from sc8pr.plot import plot
+from sc8pr.util import AssetCache
+
+
+def test_image_from_canvas():
+    img = Image(Canvas((20, 10), "red"))
+    assert img.size == (20, 10)
+    assert img.original.get_at((5, 5)) == (255, 0, 0, 255)
+
+
+def test_image_from_graphic():
+    img = Image(Circle(10).config(fill="blue"))
+    assert img.original.get_at(img.original.get_rect().center)[:3] == (0, 0, 255)
+
+
+def test_image_from_pil():
+    PIL = pytest.importorskip("PIL.Image")
+    img = Image(PIL.new("RGBA", (8, 6), (0, 255, 0, 255)))
+    assert img.size == (8, 6)
+    assert img.original.get_at((3, 3)) == (0, 255, 0, 255)
+
+
+def test_plot_markers():
+    cv = Canvas((100, 100))
+    assert plot(cv, [(10, 10), (50, 50)], markers=Circle(5).config(fill="red")) == 2
+    assert len(cv) == 2
+
+
+def test_asset_edits_are_private():
+    a, b = Image.fromZip("alien"), Image.fromZip("alien")
+    assert a.original is not b.original
+    px = b.original.get_at((5, 5))
+    a.original.fill((255, 0, 0, 255))
+    a.dumpCache()
+    assert b.original.get_at((5, 5)) == px
+    assert Image.fromZip("alien").original.get_at((5, 5)) == px
+
+
+def test_asset_scaled_variants_are_shared():
+    a, b = Image.fromZip("alien"), Image.fromZip("alien")
+    assert a.config(width=40).image is b.config(width=40).image
+    a.dumpCache()
+    assert a.image is not b.image
+
+
+def test_asset_cache_trim():
+    img = Image.fromZip("alien")
+    img.config(width=40).image
+    AssetCache.trim(0)
+    assert AssetCache._scaled == {}
+    assert AssetCache.isAsset(img._srf._asset)
+    del img
+    gc.collect()
+    AssetCache.trim(0)
+    assert AssetCache._memory == 0 and not AssetCache._assets
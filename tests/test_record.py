@@ -0,0 +1,47 @@
+# Copyright 2015-2023 D.G. MacCarthy <https://dmaccarthy.github.io/sc8pr>
+#
+# This file is part of "sc8pr".
+#
+# "sc8pr" is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# "sc8pr" is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with "sc8pr".  If not, see <http://www.gnu.org/licenses/>.
+
+"Replaying a recorded session reproduces the original run"
+
+import random
+import pygame
+from sc8pr import Sketch
+
+
+def session(size, fn, record):
+    "Run a sketch that logs clicks and random numbers, recording or replaying its events"
+    sk = Sketch(size)
+    sk.log = []
+    def setup(sk):
+        sk.log.append(sk.size)
+        sk.bind(onmousedown=lambda g, e: sk.log.append((sk.frameCount, e.pos, random.random())))
+    def ondraw(sk, ev):
+        if record and sk.frameCount % 5 == 2:
+            pygame.event.post(pygame.event.Event(pygame.MOUSEBUTTONDOWN, pos=(sk.frameCount, 7), button=1))
+    sk.bind(setup, ondraw)
+    if record: sk.record(fn).simulate(30)
+    else: sk.replay(fn)
+    return sk
+
+
+def test_replay_matches_recording(tmp_path):
+    fn = str(tmp_path / "session.s8e")
+    rec = session((200, 100), fn, True)
+    play = session((320, 240), fn, False)
+    assert play.size == (200, 100)
+    assert len(rec.log) > 3 and play.log == rec.log
+    assert play.frameCount == rec.frameCount
@@ -0,0 +1,58 @@
+# Copyright 2015-2023 D.G. MacCarthy <https://dmaccarthy.github.io/sc8pr>
+#
+# This file is part of "sc8pr".
+#
+# "sc8pr" is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# "sc8pr" is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with "sc8pr".  If not, see <http://www.gnu.org/licenses/>.
+
+"Retained-mode rendering must produce the same pixels as a full redraw"
+
+from random import seed, uniform
+import pygame
+from sc8pr import Sketch, Image, BOTH
+from sc8pr.sprite import Sprite
+from sc8pr.shape import Line, Circle, Polygon
+
+
+def frames(retained, n=60, lines=True):
+    "Render n frames of a scene and return the pixel data of each frame"
+    seed(1)
+    sk = Sketch((300, 200)).config(headless=True, retained=retained, bg="white")
+    sk._start(None, None, 0)
+    if lines:
+        sk += Line((0, 100), (300, 100)).config(weight=2)
+        sk += Line((0, 0), (300, 200)).config(weight=3, stroke="blue")
+    sk += Circle(20).config(pos=(60, 60), fill="yellow", weight=2)
+    sk += Polygon([(200, 20), (260, 40), (230, 90)]).config(fill="green", weight=2)
+    img = Image((10, 10), "red")
+    for i in range(25):
+        sk += Sprite(img).config(pos=(uniform(0, 300), uniform(0, 200)),
+            vel=(uniform(-3, 3), uniform(-3, 3)), bounce=BOTH)
+    data = []
+    for f in range(n):
+        sk._frame()
+        data.append(pygame.image.tobytes(sk.image, "RGB"))
+    sk._stop()
+    return data
+
+
+def test_retained_matches_full_redraw_with_lines():
+    full, retained = frames(False), frames(True)
+    diff = [i for i in range(len(full)) if full[i] != retained[i]]
+    assert diff == []
+
+
+def test_retained_matches_full_redraw_without_lines():
+    full, retained = frames(False, lines=False), frames(True, lines=False)
+    diff = [i for i in range(len(full)) if full[i] != retained[i]]
+    assert diff == []
@@ -0,0 +1,52 @@
+# Copyright 2015-2023 D.G. MacCarthy <https://dmaccarthy.github.io/sc8pr>
+#
+# This file is part of "sc8pr".
+#
+# "sc8pr" is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# "sc8pr" is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with "sc8pr".  If not, see <http://www.gnu.org/licenses/>.
+
+"Polygon rotation caching"
+
+import gc
+from random import seed, uniform
+import pygame
+from sc8pr import Sketch
+from sc8pr.shape import Polygon, PolygonSprite
+from sc8pr.util import CachedSurface
+
+
+def spin(rotCache, n=40, frames=60):
+    "Render spinning polygons with the specified rotation cache size"
+    seed(3)
+    sk = Sketch((300, 200)).config(headless=True, bg="white")
+    sk._start(None, None, 0)
+    for i in range(n):
+        sk += PolygonSprite([(0, 0), (20, 0), (24, 10), (10, 18), (0, 12)]).config(
+            fill="green", angleStep=5, rotCache=rotCache, pos=(uniform(0, 300), uniform(0, 200)),
+            spin=uniform(-10, 10))
+    data = []
+    for f in range(frames):
+        sk._frame()
+        data.append(pygame.image.tobytes(sk.image, "RGB"))
+    sk._stop()
+    return data
+
+
+def test_rotation_cache_matches_uncached():
+    assert spin(16) == spin(0)
+
+
+def test_rotation_cache_released():
+    spin(16)
+    gc.collect()
+    assert len(CachedSurface.lru) == 0